@@ -0,0 +1,99 @@
+"""
+Compare the size of the Earth Engine request graph built by returnCovariates() with per-index
+addBands() chains vs fused indices (indices.getIndicesFused), then check that both modes give
+the same index values, including the masking of negative surface reflectance inputs.
+
+Graphs are built and serialized client-side, only the value check makes a request.
+
+usage: python benchmarks/covariate_graph_size.py
+"""
+import ee
+from rlcms.covariates import returnCovariates, indices
+from rlcms.local.covariates import INDICES
+
+ee.Initialize()
+
+def graph_size(obj):
+    """
+    Serialized size of an ee object's request graph
+    returns:
+        dict: unique nodes in the compacted graph, function invocations in the expanded tree,
+            max nesting depth of the expanded tree, and bytes of the compacted request payload
+    """
+    compact = ee.serializer.encode(obj,is_compound=True,for_cloud_api=True)
+    tree = ee.serializer.encode(obj,is_compound=False,for_cloud_api=True)
+
+    def walk(node,depth):
+        if isinstance(node,dict):
+            invocations = 1 if 'functionInvocationValue' in node else 0
+            deepest = depth
+            for v in node.values():
+                i,d = walk(v,depth + (1 if 'functionInvocationValue' in node else 0))
+                invocations += i
+                deepest = max(deepest,d)
+            return invocations,deepest
+        elif isinstance(node,list):
+            invocations,deepest = 0,depth
+            for v in node:
+                i,d = walk(v,depth)
+                invocations += i
+                deepest = max(deepest,d)
+            return invocations,deepest
+        return 0,depth
+
+    invocations,depth = walk(tree,0)
+    return {'nodes':len(compact['values']),
+            'invocations':invocations,
+            'depth':depth,
+            'payload_bytes':len(ee.serializer.toJSON(obj))}
+
+def index_values(fused):
+    """
+    Every catalogue index computed on pixels with negative inputs (water, shadow) and one with only positive inputs
+    returns:
+        list[dict]: index values of each pixel, masked pixels are None
+    """
+    bands = ['blue','green','red','nir','swir1','swir2']
+    pixels = [[0.05,0.08,0.06,-0.01,-0.02,-0.01],   # water, negative nir and swir
+              [-0.01,0.02,0.03,0.04,0.05,0.03],     # shadow, negative blue
+              [0.04,0.07,0.05,0.30,0.20,0.10]]      # vegetation
+    covariates = list(INDICES.keys())
+    values = []
+    for pixel in pixels:
+        img = ee.Image.constant(pixel).rename(bands).float()
+        img = indices().getIndices(img,covariates,fused)
+        values.append(img.select(covariates).reduceRegion(ee.Reducer.first(),ee.Geometry.Point([0,0]),30))
+    return ee.List(values).getInfo()
+
+def check_values():
+    """print every index whose fused value differs from the chained one, masked values must match exactly"""
+    chained,fused = index_values(False),index_values(True)
+    mismatches = []
+    for i,(c,f) in enumerate(zip(chained,fused)):
+        for name in c:
+            if (c[name] is None) != (f[name] is None) or (c[name] is not None and abs(c[name]-f[name]) > 1e-5):
+                mismatches.append((i,name,c[name],f[name]))
+    for i,name,c,f in mismatches:
+        print(f"pixel {i} {name}: chained = {c}, fused = {f}")
+    print(f"fused vs chained values: {len(mismatches)} mismatches")
+    return len(mismatches) == 0
+
+def main():
+    bands = ['blue','green','red','nir','swir1','swir2']
+    names = bands + [f'p20_{b}' for b in bands] + [f'p80_{b}' for b in bands] + ['thermal']
+    img = ee.Image.constant([0.1]*len(names)).rename(names)
+
+    results = {'chained':graph_size(returnCovariates(img,fused=False)),
+               'fused':graph_size(returnCovariates(img,fused=True))}
+
+    print(f"{'mode':<10}{'nodes':>10}{'invocations':>14}{'depth':>8}{'payload_bytes':>16}")
+    for mode,r in results.items():
+        print(f"{mode:<10}{r['nodes']:>10}{r['invocations']:>14}{r['depth']:>8}{r['payload_bytes']:>16}")
+    for k in ['nodes','invocations','depth','payload_bytes']:
+        print(f"{k}: fused/chained = {results['fused'][k]/results['chained'][k]:.2f}")
+    
+    if not check_values():
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
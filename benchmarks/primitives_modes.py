@@ -0,0 +1,83 @@
+"""
+Compare training and classification cost and accuracy of the primitive modes on a local sample table
+(see rlcms.local.primitives.train_primitives): 'per_class' ranks features with an all-feature model per primitive,
+'shared' ranks them once with a multiclass screening model, optionally refined per primitive, and 'multiclass'
+trains a single multi-probability model instead of one binary model per class.
+
+Accuracy is that of the max probability assemblage (Primitives.assemble_max_probability) on held-out samples.
+Without --table a synthetic table is generated. Requires scikit-learn.
+
+usage: python benchmarks/primitives_modes.py [--table samples.csv] [--class_name LANDCOVER]
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from rlcms.local import primitives
+
+MODES = {'per_class':{'importance_mode':'per_class'},
+         'shared':{'importance_mode':'shared'},
+         'shared+refine':{'importance_mode':'shared','refine':True},
+         'multiclass':{'model_mode':'multiclass'}}
+
+def synthetic_table(n_samples:int=3000,n_classes:int=15,n_features:int=60,seed:int=0):
+    """class-dependent features, a few informative per class, the rest noise"""
+    rng = np.random.default_rng(seed)
+    labels = rng.integers(1,n_classes+1,size=n_samples)
+    table = {'LANDCOVER':labels}
+    for i in range(n_features):
+        signal = (labels == (i % n_classes) + 1)*rng.uniform(0.5,2) if i < 3*n_classes else 0
+        table[f'b{i}'] = rng.normal(size=n_samples) + signal
+    return pd.DataFrame(table)
+
+def assemble(prims:list,test:pd.DataFrame):
+    """per-sample argmax over primitive probabilities, each distinct model scoring the samples once"""
+    scored = {}
+    probabilities = []
+    for p in prims:
+        key = id(p['model'])
+        if key not in scored:
+            scored[key] = p['model'].predict_proba(test[p['features']].to_numpy(dtype=np.float32))
+        probabilities.append(scored[key][:,list(p['model'].classes_).index(p['class_value'])])
+    return np.asarray([p['Primitive'] for p in prims])[np.stack(probabilities).argmax(axis=0)]
+
+def run(table:pd.DataFrame,class_name:str,test_fraction:float,max_workers:int,**params):
+    rng = np.random.default_rng(51515)
+    test = rng.random(len(table)) < test_fraction
+    train,held_out = table[~test],table[test]
+    n_classes = train[class_name].nunique()
+    truth = held_out[class_name].round().astype(int).to_numpy()
+
+    results = {}
+    for mode,kwargs in MODES.items():
+        start = time.perf_counter()
+        prims = primitives.train_primitives(train,class_name=class_name,max_workers=max_workers,**kwargs,**params)
+        trained = time.perf_counter()
+        predicted = assemble(prims,held_out)
+        classified = time.perf_counter()
+        results[mode] = {'train_seconds':trained - start,
+                         'classify_seconds':classified - trained,
+                         'forests':sum(p['fits'] for p in prims) + (kwargs.get('importance_mode') == 'shared'),
+                         'mean_oob_error':float(np.mean([p['oobError'] for p in prims])),
+                         'accuracy':float(np.mean(predicted == truth))}
+    print(f"{len(train)} training / {len(held_out)} test samples, {n_classes} classes")
+    print(f"{'mode':<16}{'train_s':>10}{'classify_s':>12}{'forests':>10}{'mean_oob_error':>16}{'accuracy':>10}")
+    for mode,r in results.items():
+        print(f"{mode:<16}{r['train_seconds']:>10.2f}{r['classify_seconds']:>12.3f}{r['forests']:>10}"
+              f"{r['mean_oob_error']:>16.4f}{r['accuracy']:>10.4f}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark primitive feature-importance modes")
+    parser.add_argument("--table",type=str,required=False,help="sample table .csv, synthetic if not given")
+    parser.add_argument("--class_name",type=str,default='LANDCOVER',help="class label column")
+    parser.add_argument("--test_fraction",type=float,default=0.3,help="share of samples held out for accuracy")
+    parser.add_argument("--n_estimators",type=int,default=100,help="trees per forest")
+    parser.add_argument("--max_workers",type=int,required=False,help="training processes")
+    args = parser.parse_args()
+
+    table = pd.read_csv(args.table) if args.table else synthetic_table()
+    run(table,args.class_name,args.test_fraction,args.max_workers,n_estimators=args.n_estimators)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 import ee
 import os
 import re
-from rlcms.composites import Composite
+from rlcms.composites import Composite, stack_datasets, assemble_periods
+from rlcms.manifest import Manifest, settings_fingerprint, complete_periods
+from rlcms.temporal import agg_timing, parse_seasons
 from rlcms.utils import check_exists
 import argparse
 import json
@@ -82,6 +84,13 @@ def main():
     help="goes through checks and prints output asset path but does not export",
     )
     
+    parser.add_argument(
+    "--manifest",
+    type=str,
+    required=False,
+    help="local manifest .json file of already exported periods. Only periods missing from it are computed, the rest are read from their assets"
+    )
+    
     args = parser.parse_args()
     
     aoi_path = args.aoi
@@ -93,6 +102,7 @@ def main():
     crs = args.crs
     settings_f = args.settings
     dry_run = args.dry_run
+    manifest_f = args.manifest
     
     output_folder = os.path.dirname(output)
    
@@ -118,18 +128,55 @@ def main():
     
     aoi = ee.FeatureCollection(aoi_path)
     
-    # multiple datasets requested, combining multiple composites
-    if len(data) > 1: 
-        composite_list = ([Composite(dataset=d,
-                        region=aoi,
-                        start_date=start,
-                        end_date=end,
-                        **settings)
-                        # prefix dataset name to every band, if data is an asset path we swap / for _
-                        .regexpRename('^', f"{d.replace('/','_')}_") 
-                            for d in data])
+    # incremental mode, compute only periods missing from the manifest and read the others from their assets
+    if manifest_f is not None:
+        if settings.get('composite_mode') == 'seasonal' and parse_seasons(settings.get('season')) is not None:
+            raise ValueError("--manifest supports a single season per composite")
+        manifest = Manifest(manifest_f)
+        # only exports whose asset exists or whose task COMPLETED count as covered
+        pending = manifest.refresh(asset_exists=lambda a: check_exists(a) == 0,
+                                   task_state=lambda t: ee.data.getTaskStatus(t)[0]['state'])
+        manifest.save()
+        for entry in pending:
+            print(f"Export of {entry['asset']} ({entry['dataset']}) has not finished, its periods are computed again")
+        period,period_unit,periods = agg_timing(start,end,settings.get('composite_mode','annual'),settings.get('season'))
+        # a last period cut short by the end date is exported but not recorded, so extending the range recomputes it
+        recorded = complete_periods(periods,end,period,period_unit)
+        records = []
+        images = []
+        for d in data:
+            fingerprint = settings_fingerprint(d,aoi_path,start,dict(settings,scale=scale,crs=crs))
+            covered = manifest.covered(fingerprint)
+            missing = [p for p in periods if p not in covered]
+            if len(missing) > 0:
+                parts = [Composite(dataset=d,region=aoi,start_date=start,end_date=end,periods=missing,**settings).image]
+                if len(covered) > 0:
+                    parts.insert(0,assemble_periods(covered,periods))
+                    print(f"{d}: reusing {len(covered)} exported period(s), computing {missing}")
+                d_img = ee.Image.cat(parts)
+            else:
+                d_img = assemble_periods(covered,periods,static=manifest.latest(fingerprint))
+                print(f"{d}: all periods already exported")
+            records.append((d,fingerprint,len(missing) > 0))
+            images.append(d_img)
+        
+        if not any(computed for _,_,computed in records):
+            print(f"Nothing to export, every period is already recorded in {manifest_f}")
+            return
         
-        img = ee.Image.cat(composite_list)
+        if len(data) > 1:
+            img = ee.Image.cat([i.regexpRename('^', f"{d.replace('/','_')}_") for d,i in zip(data,images)])
+        else:
+            img = images[0]
+    
+    # multiple datasets requested, Composites are built concurrently and stacked, 
+    # prefixing the dataset name to every band (if data is an asset path we swap / for _)
+    elif len(data) > 1: 
+        img = stack_datasets(data,
+                             region=aoi,
+                             start_date=start,
+                             end_date=end,
+                             **settings)
     
     # only one dataset requested
     else:
@@ -137,21 +184,21 @@ def main():
                         region=aoi,
                         start_date=start,
                         end_date=end,
-                        **settings)
+                        **settings).image
     
     if dry_run:
         print(f"would export: {output}")
     
     else:
         if crs == None:
-            task = ee.batch.Export.image.toAsset(image=img.image,
+            task = ee.batch.Export.image.toAsset(image=img,
                                         description=os.path.basename(output),
                                         assetId=output,
                                         region=aoi.geometry(),
                                         scale=scale,
                                         maxPixels=1e12)
         else:
-            task = ee.batch.Export.image.toAsset(image=img.image,
+            task = ee.batch.Export.image.toAsset(image=img,
                                         description=os.path.basename(output),
                                         assetId=output,
                                         region=aoi.geometry(),
@@ -160,6 +207,18 @@ def main():
                                         crs=crs)
         task.start()
         print(f"Export started (Asset): {output}") 
+        
+        if manifest_f is not None:
+            # the exported stack holds every period, record it with its band names (one request per dataset),
+            # pending until a later run finds the asset or the task completed
+            for (d,fingerprint,_),d_img in zip(records,images):
+                prefix = f"{d.replace('/','_')}_" if len(data) > 1 else ''
+                manifest.add(d,fingerprint,aoi_path,recorded,output,d_img.bandNames().getInfo(),prefix,task_id=task.id)
+            manifest.save()
+            print(f"Recorded {output} as pending (task {task.id}) in manifest: {manifest_f}")
+            partial = [p for p in periods if p not in recorded]
+            if len(partial) > 0:
+                print(f"Period(s) {partial} end after {end} and are not recorded, a later run computes them again")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -67,6 +67,46 @@ def main():
         help="The local folder to export metrics files."
     )
     
+    parser.add_argument(
+        "--correlation_threshold",
+        type=float,
+        required=False,
+        help="Optional. Drop input bands whose absolute correlation with an earlier band exceeds this threshold before training (e.g. 0.9)"
+    )
+    
+    parser.add_argument(
+        "--correlation_pixels",
+        type=int,
+        default=2000,
+        required=False,
+        help="Optional. Approximate number of pixels sampled to compute band correlations for --correlation_threshold. Default 2000"
+    )
+    
+    parser.add_argument(
+        "--importance_mode",
+        type=str,
+        choices=["per_class","shared"],
+        default="per_class",
+        required=False,
+        help="Optional. 'shared' ranks features once with a multiclass screening model instead of once per primitive. Default per_class"
+    )
+    
+    parser.add_argument(
+        "--refine",
+        dest="refine",
+        action="store_true",
+        help="Optional. With --importance_mode shared, still rank each primitive's top 20 features among the shared top 40"
+    )
+    
+    parser.add_argument(
+        "--model_mode",
+        type=str,
+        choices=["binary","multiclass"],
+        default="binary",
+        required=False,
+        help="Optional. 'multiclass' trains one multi-probability model for all classes instead of one binary model per class. Default binary"
+    )
+    
     parser.add_argument(
         "-d",
         "--dry_run",
@@ -84,6 +124,11 @@ def main():
     crs = args.crs
     scale = args.scale
     metrics_path = args.metrics_folder
+    correlation_threshold = args.correlation_threshold
+    correlation_pixels = args.correlation_pixels
+    importance_mode = args.importance_mode
+    refine = args.refine
+    model_mode = args.model_mode
     dry_run = args.dry_run
 
     # Run Checks
@@ -133,7 +178,15 @@ def main():
         # Construct Primitives
         prims = Primitives(inputs=input_stack,
                            training=training_data,
-                           class_name=class_name)
+                           class_name=class_name,
+                           correlation_threshold=correlation_threshold,
+                           correlation_scale=scale if scale != None else 30,
+                           correlation_num_pixels=correlation_pixels,
+                           importance_mode=importance_mode,
+                           refine=refine,
+                           model_mode=model_mode)
+        if correlation_threshold != None:
+            print(f"Training on {len(prims.bands)} bands after correlation pruning: {prims.bands}")
         # Export as GEE ImgColl asset
         prims.export_to_asset(collection_assetId=img_coll_path,
                               crs=crs,
@@ -1,7 +1,10 @@
 import ee
 import hydrafloods as hf
+from concurrent.futures import ThreadPoolExecutor
 from rlcms.harmonics import doHarmonicsFromOptions
-from rlcms.covariates import indices
+from rlcms.temporal import agg_timing, parse_seasons
+from rlcms.manifest import period_bands, static_bands
+from rlcms.covariates import indices, covariateBands, DATASET_BANDS
 from rlcms.covariates import returnCovariatesFromOptions
 from ee.ee_exception import EEException
 
@@ -9,45 +12,71 @@ ee.Initialize()
 
 idx = indices()
 
+# all hydrafloods.Dataset sub-classes, only constructed when requested (see get_dataset)
+DATASETS = {'Landsat5':hf.Landsat5,
+            'Landsat7':hf.Landsat7,
+            'Landsat8':hf.Landsat8,
+            'Landsat9':hf.Landsat9,
+            'Sentinel1':hf.Sentinel1,
+            'Sentinel1Asc':hf.Sentinel1Asc,
+            'Sentinel1Desc':hf.Sentinel1Desc,
+            'Sentinel2':hf.Sentinel2,
+            'MODIS':hf.Modis,
+            'VIIRS':hf.Viirs}
+
+_dataset_cache = {}
+
+def get_dataset(dataset:str,region:ee.Geometry,start_date:str,end_date:str):
+    """
+    Construct the hf.Dataset for a dataset name or GEE asset path, cached within the process by (dataset, region, dates)
+    args:
+        dataset (str): one of DATASETS keys or a GEE ImageCollection asset path
+        region (ee.Geometry): area of interest
+        start_date (str): start date
+        end_date (str): end date
+    returns:
+        hf.Dataset
+    """
+    if not isinstance(dataset,str):
+        raise TypeError(f"dataset must be str type, got: {type(dataset)}")
+    if dataset not in DATASETS and '/' not in dataset:
+        raise ValueError(f"Could not construct a hf.Dataset from dataset name provided: {dataset}")
+    
+    # the region's serialized graph keys the cache, this is client-side and does not make a request
+    key = (dataset,ee.serializer.toJSON(region),start_date,end_date)
+    if key not in _dataset_cache:
+        if dataset in DATASETS:
+            _dataset_cache[key] = DATASETS[dataset](region,start_date,end_date)
+        else:
+            try:
+                _dataset_cache[key] = hf.Dataset(asset_id=dataset,region=region,start_time=start_date,end_time=end_date)
+            except:
+                raise EEException
+    return _dataset_cache[key]
+
 def get_agg_timing(collection:hf.Dataset,**kwargs):
     """utility function for hf.Dataset.aggregate_time(). Formats `period`, `period_unit`, and `dates` args
         to create certain types of composites (defined by `composite_mode`)
+        
+        Periods are computed client-side from the Dataset's start and end time (see rlcms.temporal.agg_timing),
+        without fetching scene dates from the server
     args:
         collection (hf.Dataset): Hydrafloods Dataset
     kwargs:
         composite_mode (str): one of 'annual' or 'seasonal', Default = 'annual'
         season (list[str|int]): consecutive list of months (e.g. ['01','02','03']) comprising the season.
             A required arg if composite_mode == 'seasonal'
+        scene_dates (list[str]): Optional, scene dates if already available locally, 
+            periods without scenes are dropped
     Returns:
         tuple(period(int),period_unit(str),dates(list[str]))
             
     """
-    if 'composite_mode' not in kwargs:
-        composite_mode = 'annual'
-    else:
-        composite_mode = kwargs['composite_mode']
-    
-    # get unique yyyy strings
-    years = list(set([d.split(' ')[0].split('-')[0] for d in collection.dates])) 
-    years.sort()
-    
-    if composite_mode == 'seasonal':
-        if 'season' not in kwargs:
-            raise ValueError("season arg required if composite_mode == 'seasonal'")
-        else:
-            season = kwargs['season'] # must be consecutive 
-            period = len(season)
-            period_unit = 'month'
-            dates = [f"{y}-{str(season[0])}-01" for y in years]
-    elif composite_mode == 'annual':
-        period = 1
-        period_unit = 'year'
-        dates = [y+'-01-01' for y in years]
-    
-    else:
-        raise ValueError(f"{composite_mode} not a valid 'composite_mode'. Choose one of 'annual' or 'seasonal'")
-    
-    return period,period_unit,dates
+    return agg_timing(collection.start_time,
+                      collection.end_time,
+                      composite_mode=kwargs.get('composite_mode','annual'),
+                      season=kwargs.get('season'),
+                      scene_dates=kwargs.get('scene_dates'))
 
 class Composite:
     """Initializes Composite class
@@ -62,16 +91,25 @@ class Composite:
         
         kwargs:
             indices:list[str]
+            formulas:dict declarative indices that can be listed in indices, e.g. {'NDVI':'(nir - red) / (nir + red)'}
+            fuseIndices:bool compute all indices with one array operation per image instead of one addBands() each
             composite_mode:str One of ['seasonal','annual'] Default = 'annual' 
-            season:list[str|int]
+            season:list[str|int] months of the season, or several seasons as a list of month lists or a {name: months} dict 
+                (e.g. {'wet':['11','12','01'],'dry':['06','07','08']}), composited in one pass with bands prefixed by season name
             reducer:str|ee.Reducer
             addTasselCap:bool
+            tasselCapSensor:str tasseled cap coefficient set, one of 'Landsat5','Landsat7','Landsat8','Landsat9','Sentinel2'. Default = 'Landsat5'
             addTopography:bool
             addJRC:bool
             harmonicsOptions:dict in this format: {'nir':{'start':int[1:365],'end':[1:365]}}
+            periods:list[str] only composite these period start dates (yyyy-mm-dd) of the date range. Period bands are
+                then always prefixed t{i}_, i being the period's index within the whole date range
         
         returns:
             ee.Image: multi-band image composite within region
+        
+        Construction only builds the Earth Engine graph. `bands` and `region` are fetched 
+        from the server on first access and cached.
         """
     
     def __init__(self,dataset:str,
@@ -81,10 +119,8 @@ class Composite:
                     **kwargs):
     
         self.dataset=dataset
-        if isinstance(region, ee.Geometry):
-            self.region=region.getInfo()['coordinates']
-        elif isinstance(region, ee.FeatureCollection):
-            self.region = region.geometry().getInfo()['coordinates']
+        self._region = None
+        self._bands = None
         self.start_date=start_date
         self.end_date=end_date
         
@@ -99,33 +135,10 @@ class Composite:
             region = region
         else:
             raise TypeError(f"{region} must be of type ee.FeatureCollection or ee.Geometry, got {type(region)}")
-        # all hydrafloods.Dataset sub-classes
-        ds_dict = {'Landsat5':hf.Landsat5(region,start_date,end_date),
-                'Landsat7':hf.Landsat7(region,start_date,end_date),
-                'Landsat8':hf.Landsat8(region,start_date,end_date),
-                'Landsat9':hf.Landsat9(region,start_date,end_date),
-                'Sentinel1':hf.Sentinel1(region,start_date,end_date),
-                'Sentinel1Asc':hf.Sentinel1Asc(region,start_date,end_date),
-                'Sentinel1Desc':hf.Sentinel1Desc(region,start_date,end_date),
-                'Sentinel2':hf.Sentinel2(region,start_date,end_date),
-                'MODIS':hf.Modis(region,start_date,end_date),
-                'VIIRS':hf.Viirs(region,start_date,end_date)}
-        
+        self._region_geometry = region
         # dataset can either be a named dataset string supported by a hf.Dataset sub-class 
-        # or a GEE Asset path
-        if isinstance(dataset,str):
-            if dataset in ds_dict.keys(): 
-                ds = ds_dict[dataset]
-            else:
-                if '/' in dataset: 
-                    try:
-                        ds = hf.Dataset(asset_id=dataset,region=region,start_time=start_date,end_time=end_date)
-                    except:
-                        raise EEException
-                else: 
-                    raise ValueError(f"Could not construct a hf.Dataset from dataset name provided: {dataset}")
-        else:
-            raise TypeError(f"dataset must be str type, got: {type(dataset)}")
+        # or a GEE Asset path, only that one dataset is constructed
+        ds = get_dataset(dataset,region,start_date,end_date)
         
         # mask imgs to geometries in multi_poly mode
         if 'multi_poly' in kwargs:
@@ -137,7 +150,14 @@ class Composite:
                 # would require another synchronous request of aoi's type/element size
                 ds = ds.apply_func(update_mask)
         
-        ds = ds.apply_func(returnCovariatesFromOptions,**kwargs)
+        # resolve the minimal set of indices to compute once client-side, 
+        # rather than per image inside the mapped function
+        covariate_kwargs = kwargs
+        if dataset in DATASET_BANDS and 'indices' in kwargs:
+            planned,_ = covariateBands(DATASET_BANDS[dataset],**kwargs)
+            covariate_kwargs = dict(kwargs,indices=planned)
+        
+        ds = ds.apply_func(returnCovariatesFromOptions,**covariate_kwargs)
         
         # set reducer passed to aggregate_time(), default mean
         if 'reducer' in kwargs:
@@ -145,25 +165,23 @@ class Composite:
         else:
             reducer = 'mean'
         
-        period,period_unit,dates = get_agg_timing(ds,**kwargs)
-        
-        # aggregate hf.Dataset
-        agg_time_result = (ds.aggregate_time(reducer=reducer,
-                                        rename=False,
-                                        period_unit=period_unit,
-                                        period=period,
-                                        dates=dates)
-                                        )
-        
-        composite = ee.ImageCollection(agg_time_result.collection).toBands()
-        
-        # rename bands depending on number of resulting images
-        if agg_time_result.n_images > 1:
-            bnames = composite.bandNames().map(lambda b: ee.String('t').cat(b))
+        seasons = parse_seasons(kwargs.get('season')) if kwargs.get('composite_mode') == 'seasonal' else None
+        if seasons is None:
+            period,period_unit,dates = get_agg_timing(ds,**kwargs)
+            check_periods(kwargs.get('periods'),dates)
+            composite = aggregate_periods(ds,reducer,period,period_unit,dates,periods=kwargs.get('periods'))
         else:
-            bnames = composite.bandNames().map(lambda b: ee.String(b).slice(2))
-        
-        composite = composite.rename(bnames)
+            # several seasons share the dataset with covariates already computed,
+            # each season is aggregated from it and its bands prefixed with the season name
+            timings = {name:get_agg_timing(ds,composite_mode='seasonal',season=months) for name,months in seasons.items()}
+            check_periods(kwargs.get('periods'),[d for _,_,dates in timings.values() for d in dates])
+            seasonal = []
+            for name,(period,period_unit,dates) in timings.items():
+                if 'periods' in kwargs and not any(d in kwargs['periods'] for d in dates):
+                    continue
+                seasonal.append(aggregate_periods(ds,reducer,period,period_unit,dates,periods=kwargs.get('periods'))
+                                .regexpRename('^',f"{name}_"))
+            composite = ee.Image.cat(seasonal)
             
         # compute harmonics if desired
         if 'harmonicsOptions' in kwargs:
@@ -173,20 +191,37 @@ class Composite:
         # add JRC variables if desired
         if 'addJRCWater' in kwargs:
             if kwargs['addJRCWater']:
-                composite = idx.addJRC(composite).unmask(0)
+                composite = idx.addJRC(composite,region).unmask(0)
         
         # add topography variables if desired     
         if 'addTopography' in kwargs:
             if kwargs['addTopography']:
-                composite = idx.addTopography(composite).unmask(0)
+                composite = idx.addTopography(composite,region).unmask(0)
         
-        self.bands = composite.bandNames().getInfo()
         self.image = (composite.clip(region).set('dataset',dataset,
                                                      'start',start_date,
                                                      'end',end_date)
                                                     .set(kwargs)
                                                     )
         return
+    
+    @property
+    def bands(self):
+        """band names of the composite image, fetched on first access"""
+        if self._bands is None:
+            self._bands = self.image.bandNames().getInfo()
+        return self._bands
+    
+    @property
+    def region(self):
+        """coordinates of the composite's region, fetched on first access"""
+        if self._region is None:
+            self._region = self._region_geometry.getInfo()['coordinates']
+        return self._region
+
+def _prefixed(composite:Composite):
+    """composite image with every band prefixed by its dataset name, '/' in asset paths swapped for '_'"""
+    return composite.image.regexpRename('^', f"{composite.dataset.replace('/','_')}_")
 
 def stack(composites:list):
     """
@@ -200,7 +235,140 @@ def stack(composites:list):
         raise ValueError("composites must be a list of 2 or more rlcms.Composites")
     else:
         # returns list of ee.Images with renamed bands
-        renamed = [c.image.regexpRename('^', f"{c.dataset.replace('/','_')}_") for c in composites]
+        renamed = [_prefixed(c) for c in composites]
         # stack renamed image list into one ee.Image
         stacked = ee.Image.cat(renamed)
-        return stacked
\ No newline at end of file
+        return stacked
+
+def check_periods(periods:list,dates:list):
+    """raise a ValueError if any of `periods` is not one of the period start `dates`"""
+    if periods is None:
+        return
+    unknown = [p for p in periods if p not in dates]
+    if len(unknown) > 0:
+        raise ValueError(f"periods {unknown} are not period start dates of the date range: {dates}")
+
+def aggregate_periods(ds:hf.Dataset,
+                      reducer,
+                      period:int,
+                      period_unit:str,
+                      dates:list,
+                      periods:list=None):
+    """
+    Aggregate a hf.Dataset over periods starting on `dates` into one image, one set of bands per period
+    args:
+        ds (hf.Dataset): Hydrafloods Dataset
+        reducer (str|ee.Reducer): reducer passed to aggregate_time()
+        period (int): period length
+        period_unit (str): one of 'year' or 'month'
+        dates (list[str]): period start dates
+        periods (list[str]): Optional, only aggregate these of `dates`. Bands are then always 
+            prefixed t{i}_, i being the period's index in `dates`
+    returns:
+        ee.Image: bands prefixed t{i}_ if there are several periods, unprefixed otherwise
+    """
+    # restrict to the requested periods, keeping their index within the full date range
+    if periods is not None:
+        period_index = [i for i,d in enumerate(dates) if d in periods]
+        dates = [dates[i] for i in period_index]
+    
+    # aggregate hf.Dataset
+    agg_time_result = (ds.aggregate_time(reducer=reducer,
+                                    rename=False,
+                                    period_unit=period_unit,
+                                    period=period,
+                                    dates=dates)
+                                    )
+    
+    composite = ee.ImageCollection(agg_time_result.collection).toBands()
+    
+    # rename bands depending on number of resulting images, one per date
+    # (len(dates) rather than agg_time_result.n_images, which is a getInfo() call)
+    if periods is not None:
+        for i,g in enumerate(period_index):
+            composite = composite.regexpRename(f"^{i}_",f"t{g}_")
+    else:
+        if len(dates) > 1:
+            bnames = composite.bandNames().map(lambda b: ee.String('t').cat(b))
+        else:
+            bnames = composite.bandNames().map(lambda b: ee.String(b).slice(2))
+        
+        composite = composite.rename(bnames)
+    return composite
+
+def assemble_periods(covered:dict,periods:list,static:dict=None):
+    """
+    Assemble a multi-period stack from exported composite assets recorded in a rlcms.manifest.Manifest,
+    selecting each period's t{i}_ bands from the newest asset covering it
+    args:
+        covered (dict): period start date -> manifest entry, as returned by Manifest.covered()
+        periods (list[str]): all period start dates of the date range, a period's position is its band prefix index
+        static (dict): Optional, manifest entry whose bands without a period prefix (harmonics, JRC, topography)
+            are added as well
+    returns:
+        ee.Image
+    """
+    selections = {} # asset -> (entry, band names), in order of first use
+    for i,p in enumerate(periods):
+        if p in covered:
+            entry = covered[p]
+            selections.setdefault(entry['asset'],(entry,[]))[1].extend(period_bands(entry['bands'],i))
+    if static is not None:
+        selections.setdefault(static['asset'],(static,[]))[1].extend(static_bands(static['bands']))
+    if len(selections) == 0:
+        raise ValueError("no exported periods to assemble")
+    
+    images = [ee.Image(asset).select([entry['prefix']+b for b in names]).rename(names) 
+              for asset,(entry,names) in selections.items()]
+    return ee.Image.cat(images)
+
+def build_composites(datasets:list,
+                     region:ee.FeatureCollection,
+                     start_date:str,
+                     end_date:str,
+                     max_workers:int=None,
+                     **kwargs):
+    """
+    Construct one rlcms.Composite per dataset concurrently in a thread pool, so requests made while
+    building each Composite overlap instead of running one after another
+    args:
+        datasets (list[str]): dataset names or GEE ImageCollection asset paths
+        region (ee.FeatureCollection|ee.Geometry): area of interest
+        start_date (str): start date
+        end_date (str): end date
+        max_workers (int): Optional, max number of Composites built at once. Default = one per dataset
+        **kwargs: Composite kwargs, shared by every dataset
+    returns:
+        list[rlcms.Composite]: in the order of `datasets`
+    """
+    if len(datasets) == 0:
+        raise ValueError("datasets must contain at least one dataset")
+    if max_workers is None:
+        max_workers = len(datasets)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(Composite,d,region,start_date,end_date,**kwargs) for d in datasets]
+        # result() re-raises the first failing dataset's exception
+        return [f.result() for f in futures]
+
+def stack_datasets(datasets:list,
+                   region:ee.FeatureCollection,
+                   start_date:str,
+                   end_date:str,
+                   max_workers:int=None,
+                   **kwargs):
+    """
+    Build Composites of several datasets concurrently (see build_composites) and stack them,
+    prefixing each band with its dataset name like stack()
+    args:
+        datasets (list[str]): 2 or more dataset names or GEE ImageCollection asset paths
+        region (ee.FeatureCollection|ee.Geometry): area of interest
+        start_date (str): start date
+        end_date (str): end date
+        max_workers (int): Optional, max number of Composites built at once. Default = one per dataset
+        **kwargs: Composite kwargs, shared by every dataset
+    returns:
+        ee.Image
+    """
+    if len(datasets) < 2:
+        raise ValueError("datasets must be a list of 2 or more datasets")
+    return stack(build_composites(datasets,region,start_date,end_date,max_workers=max_workers,**kwargs))
@@ -1,8 +1,77 @@
 import ee, math
 from rlcms.utils import parse_settings
+from rlcms.local.covariates import INDICES, tasseled_cap_coefficients, tasseled_cap_bands
+from rlcms.formulas import compile_formulas
+
+# band names of each hydrafloods Dataset supported by rlcms.Composite, 
+# so covariate planning can happen client-side without bandNames().getInfo()
+DATASET_BANDS = {'Landsat5':['blue','green','red','nir','swir1','swir2'],
+				 'Landsat7':['blue','green','red','nir','swir1','swir2'],
+				 'Landsat8':['blue','green','red','nir','swir1','swir2'],
+				 'Landsat9':['blue','green','red','nir','swir1','swir2'],
+				 'Sentinel1':['VV','VH','angle'],
+				 'Sentinel1Asc':['VV','VH','angle'],
+				 'Sentinel1Desc':['VV','VH','angle'],
+				 'Sentinel2':['blue','green','red','nir','swir1','swir2'],
+				 'MODIS':['red','nir','blue','green','swir1','swir2'],
+				 'VIIRS':['red','nir','blue','green','swir1','swir2']}
+
+# bands added by indices.addAllTasselCapIndices() with the default coefficients
+TASSELCAP_BANDS = tasseled_cap_bands()
+
+def topography(elevation):
+	""" slope, aspect, eastness and northness derived from an elevation image """
+	# Calculate slope, aspect, and hillshade
+	topo = ee.Algorithms.Terrain(elevation)
+	
+	# From aspect (a), calculate eastness (sin a), northness (cos a)
+	deg2rad = ee.Number(math.pi).divide(180)
+	aspect = topo.select(['aspect'])
+	aspect_rad = aspect.multiply(deg2rad)
+	eastness = aspect_rad.sin().rename(['eastness']).float()
+	northness = aspect_rad.cos().rename(['northness']).float()
+	
+	return topo.select(['elevation','slope','aspect']).addBands(eastness).addBands(northness)
+
+def jrcWater(jrcImage):
+	""" JRC Water layers: 'occurrence', 'change_abs', 'change_norm', 'seasonality','transition', 'max_extent' """
+	return jrcImage.select(['occurrence','change_abs','change_norm','seasonality','transition','max_extent'])
+
+# time-invariant covariates: name -> (asset ID, function deriving the layer from the asset's ee.Image)
+STATIC_LAYERS = {'topography':("USGS/SRTMGL1_003",topography),
+				 'jrc':("JRC/GSW1_0/GlobalSurfaceWater",jrcWater)}
+
+_staticLayerCache = {}
+
+def getStaticLayer(name,aoi=None):
+	"""
+	Get a time-invariant covariate layer, derived once and memoized within the process by asset ID and aoi
+	args:
+		name (str): a key of STATIC_LAYERS
+		aoi (ee.Geometry|ee.FeatureCollection): Optional, clip the layer to this area
+	returns:
+		ee.Image
+	"""
+	if name not in STATIC_LAYERS:
+		raise ValueError(f"Unknown static layer: {name}. Choose from: {list(STATIC_LAYERS.keys())}")
+	assetId,func = STATIC_LAYERS[name]
+	
+	# serialize the aoi to key the cache, this is client-side and does not make a request
+	key = (assetId, None if aoi is None else ee.serializer.toJSON(aoi))
+	if key not in _staticLayerCache:
+		layer = func(ee.Image(assetId))
+		if aoi is not None:
+			if isinstance(aoi,ee.FeatureCollection):
+				aoi = aoi.geometry()
+			layer = layer.clip(aoi)
+		_staticLayerCache[key] = layer
+	return _staticLayerCache[key]
+
 class indices():
 
-	def __init__(self):
+	def __init__(self,formulas=None):
+		""" formulas (dict): Optional, declarative indices to add to the catalogue, 
+			e.g. {'NDVI':'(nir - red) / (nir + red)'}, see rlcms.formulas.compile_formulas() """
 		
 		
 		 
@@ -27,22 +96,22 @@ class indices():
 							 "EVI" : self.EVI, \
 							 "SAVI" : self.SAVI, \
 							 "IBI" : self.IBI}
+		
+		self.formulas = dict(formulas) if formulas is not None else {}
+		for name,formula in self.formulas.items():
+			self.functionList[name] = (lambda img,name=name,formula=formula: self.addFormulas(img,{name:formula}))
 
 
-	def addAllTasselCapIndices(self,img): 
-		""" Function to get all tasselCap indices """
+	def addAllTasselCapIndices(self,img,sensor=None): 
+		""" Function to get all tasselCap indices. sensor selects the coefficient set 
+		(see rlcms.local.covariates.TASSELED_CAP_COEFFICIENTS), default 'Landsat5' """
+		
+		table = tasseled_cap_coefficients(sensor)
 		
 		def getTasseledCap(img):
 			"""Function to compute the Tasseled Cap transformation and return an image"""
 			
-			coefficients = ee.Array([
-				[0.3037, 0.2793, 0.4743, 0.5585, 0.5082, 0.1863],
-				[-0.2848, -0.2435, -0.5436, 0.7243, 0.0840, -0.1800],
-				[0.1509, 0.1973, 0.3279, 0.3406, -0.7112, -0.4572],
-				[-0.8242, 0.0849, 0.4392, -0.0580, 0.2012, -0.2768],
-				[-0.3280, 0.0549, 0.1075, 0.1855, -0.4357, 0.8085],
-				[0.1084, -0.9022, 0.4120, 0.0573, -0.0251, 0.0238]
-			])
+			coefficients = ee.Array(table)
 		
 			bands=ee.List(['blue','green','red','nir','swir1','swir2'])
 			
@@ -52,7 +121,7 @@ class indices():
 			# Make an Array Image with a 2-D Array per pixel, 6x1.
 			arrayImage2D = arrayImage1D.toArray(1)
 		
-			componentsImage = ee.Image(coefficients).matrixMultiply(arrayImage2D).arrayProject([0]).arrayFlatten([['brightness', 'greenness', 'wetness', 'fourth', 'fifth', 'sixth']]).float()
+			componentsImage = ee.Image(coefficients).matrixMultiply(arrayImage2D).arrayProject([0]).arrayFlatten([tasseled_cap_bands(sensor)[:len(table)]]).float()
 	  
 			# Get a multi-band image with TC-named bands.
 			return img.addBands(componentsImage);	
@@ -199,64 +268,147 @@ class indices():
 		
 		return img
 
-	def addTopography(self,img): 
+	def addTopography(self,img,aoi=None): 
 		"""  Function to add 30m SRTM elevation and derived slope, aspect, eastness, and 
 		northness to an image. Elevation is in meters, slope is between 0 and 90 deg,
 		aspect is between 0 and 359 deg. Eastness and northness are unitless and are
-		between -1 and 1. """
-
-		# Import SRTM elevation data
-		elevation = ee.Image("USGS/SRTMGL1_003")
-		
-		# Calculate slope, aspect, and hillshade
-		topo = ee.Algorithms.Terrain(elevation)
-		
-		# From aspect (a), calculate eastness (sin a), northness (cos a)
-		deg2rad = ee.Number(math.pi).divide(180)
-		aspect = topo.select(['aspect'])
-		aspect_rad = aspect.multiply(deg2rad)
-		eastness = aspect_rad.sin().rename(['eastness']).float()
-		northness = aspect_rad.cos().rename(['northness']).float()
+		between -1 and 1. The layer is only derived once per process and aoi, see getStaticLayer() """
 		
-		# Add topography bands to image
-		topo = topo.select(['elevation','slope','aspect']).addBands(eastness).addBands(northness)
-		img = img.addBands(topo)
-		return img
+		return img.addBands(getStaticLayer('topography',aoi))
 
-	def addJRC(self,img):
+	def addJRC(self,img,aoi=None):
 		""" Function to add JRC Water layers: 'occurrence', 'change_abs', 
-			'change_norm', 'seasonality','transition', 'max_extent' """
+			'change_norm', 'seasonality','transition', 'max_extent'. 
+			The layer is only derived once per process and aoi, see getStaticLayer() """
+		
+		return img.addBands(getStaticLayer('jrc',aoi))
+
+
+	def getIndices(self,img,covariates,fused=False,bands=None):	
+		""" add indices to image, one addBands() per index or all at once if fused=True.
+		If the image's band names are known client-side (bands), indices that already exist are not recomputed """
+		if bands is not None:
+			indices = self.removeDuplicates(covariates,bands)
+		else:
+			indices = covariates
 		
-		jrcImage = ee.Image("JRC/GSW1_0/GlobalSurfaceWater")
+		# declarative indices are compiled together so they share common subexpressions
+		formulas = {i:self.formulas[i] for i in indices if i in self.formulas}
+		indices = [i for i in indices if i not in formulas]
 		
-		img = img.addBands(jrcImage.select(['occurrence']).rename(['occurrence']))
-		img = img.addBands(jrcImage.select(['change_abs']).rename(['change_abs']))
-		img = img.addBands(jrcImage.select(['change_norm']).rename(['change_norm']))
-		img = img.addBands(jrcImage.select(['seasonality']).rename(['seasonality']))
-		img = img.addBands(jrcImage.select(['transition']).rename(['transition']))
-		img = img.addBands(jrcImage.select(['max_extent']).rename(['max_extent']))
+		if fused:
+			img = self.getIndicesFused(img,indices)
+		else:
+			for item in indices:
+				img = self.functionList[item](img)
 		
-		return img
+		if len(formulas) > 0:
+			img = self.addFormulas(img,formulas)
 
+		return img
 
-	def getIndices(self,img,covariates):	
-		""" add indices to image"""
-		# self = indices()
-		# no need to add indices that are already there
-		# see TODO below, can't use removeDuplicates in .map()
-		# indices = self.removeDuplicates(covariates,img.bandNames().getInfo())
-		indices = covariates
+	def addFormulas(self,img,formulas):
+		""" add declarative indices (dict of name: formula) to image. Formulas are compiled once (cached) 
+		and shared subexpressions are computed a single time as intermediate ee.Image.expression() images """
+		compiled = compile_formulas(formulas)
+		images = {b:img.select(b) for b in compiled.bands}
+		outputs = []
+		for name,expression,refs,isOutput in compiled.steps:
+			images[name] = img.expression(expression,{r:images[r] for r in refs})
+			if isOutput:
+				outputs.append(images[name].rename([name]))
 		
-		for item in indices:
-			img = self.functionList[item](img)
+		return img.addBands(ee.Image.cat(outputs).float())
 
-		return img
+	def getIndicesFused(self,img,covariates):
+		""" add indices to image with a single array operation instead of one addBands() per index.
+		Every index in the catalogue is a ratio of two affine band combinations (IBI is a normalized 
+		difference of such ratios), so all of them are computed by one matrixMultiply() of the band 
+		vector for numerators and one for denominators. 
+		Like normalizedDifference(), normalized difference indices (ND_* and IBI) are masked where either 
+		of their inputs is negative, so both modes give the same values """
+		
+		unknown = [c for c in covariates if c not in INDICES]
+		if len(unknown) > 0:
+			raise ValueError(f"Unknown indices: {unknown}")
+		if len(covariates) == 0:
+			return img
+		
+		bands = []
+		for item in covariates:
+			bands += [b for b in INDICES[item][1] if b not in bands]
+		terms = bands + ['constant']
+		
+		def row(coefs):
+			return [float(coefs.get(t,0)) for t in terms]
+		
+		def ratioRows(kind,inputs):
+			""" (numerator,denominator) coefficient rows over terms """
+			if kind == 'nd':
+				a,b = inputs
+				return [row({a:1,b:-1})], [row({a:1,b:1})]
+			elif kind == 'ratio':
+				a,b = inputs
+				return [row({a:1})], [row({b:1})]
+			elif kind == 'evi':
+				return [row({'nir':2.5,'red':-2.5})], [row({'nir':1,'red':6,'blue':-7.5,'constant':1})]
+			elif kind == 'savi':
+				return [row({'nir':1.5,'red':-1.5})], [row({'nir':1,'red':1,'constant':0.5})]
+			elif kind == 'ibi':
+				# IBI_A = 2*SWIR1/(SWIR1 + NIR), IBI_B is the sum of the other two ratios
+				return ([row({'swir1':2}),row({'nir':1}),row({'green':1})],
+						[row({'swir1':1,'nir':1}),row({'nir':1,'red':1}),row({'green':1,'swir1':1})])
+		
+		names = [c for c in covariates if c != 'IBI']
+		hasIBI = 'IBI' in covariates
+		num, den = [], []
+		for item in names + (['IBI'] if hasIBI else []):
+			n,d = ratioRows(*INDICES[item])
+			num += n
+			den += d
+		
+		x = img.select(bands).addBands(ee.Image.constant(1).rename('constant')).toArray().toArray(1)
+		ratios = ee.Image(ee.Array(num)).matrixMultiply(x).divide(ee.Image(ee.Array(den)).matrixMultiply(x))
+		
+		# normalizedDifference() masks pixels where either input is negative, one mask band per output
+		nonNegative = img.select(bands).gte(0)
+		masks = []
+		for item in names:
+			kind,inputs = INDICES[item]
+			if kind == 'nd':
+				masks.append(nonNegative.select(inputs[0]).And(nonNegative.select(inputs[1])))
+			else:
+				masks.append(ee.Image.constant(1))
+		
+		if hasIBI:
+			k = len(names)
+			ibiParts = ratios.arraySlice(0,k,k+3)
+			# [IBI_A, IBI_B], IBI is their normalized difference
+			ibiAB = ee.Image(ee.Array([[1,0,0],[0,1,1]])).matrixMultiply(ibiParts)
+			ibi = (ee.Image(ee.Array([[1,-1]])).matrixMultiply(ibiAB)
+					.divide(ee.Image(ee.Array([[1,1]])).matrixMultiply(ibiAB)))
+			ratios = ratios.arraySlice(0,0,k).arrayCat(ibi,0) if k > 0 else ibi
+			masks.append(ibiAB.arrayReduce(ee.Reducer.min(),[0]).arrayGet([0,0]).gte(0))
+			names = names + ['IBI']
+		
+		fused = ratios.arrayProject([0]).arrayFlatten([names]).float().updateMask(ee.Image.cat(masks))
+		if names != list(covariates):
+			fused = fused.select(list(covariates))
+		return img.addBands(fused)
 
 	def removeDuplicates(self,covariateList,bands):
-		""" function to remove duplicates, i.e. existing bands do not need to be calculated """
-		# TODO: this does not scale to being mappable server side (can't use getInfo in mapped functions)
-		# would need to EEify this logic to use with ee.List()'s
-		return [elem for elem in covariateList if elem not in bands]
+		""" function to remove duplicates, i.e. existing bands do not need to be calculated.
+		Runs client-side on a known band list (see DATASET_BANDS and covariateBands()), 
+		so resolve the list once before mapping over a collection rather than inside the mapped function """
+		planned = []
+		for elem in covariateList:
+			if elem not in bands and elem not in planned:
+				planned.append(elem)
+		
+		missing = sorted(set(b for elem in planned if elem in INDICES for b in INDICES[elem][1]) - set(bands))
+		if len(missing) > 0:
+			raise ValueError(f"Cannot compute indices {planned}, image is missing bands: {missing}")
+		return planned
 
 	def renameBands(self,image,prefix):
 		""" renames bands with prefix """
@@ -274,8 +426,10 @@ class indices():
 		return image
 
 
-def returnCovariates(img):
-	"""Workflow for computing Landsat and covariates. bands and covariates are hardcoded inside the function."""
+def returnCovariates(img,fused=False,aoi=None):
+	"""Workflow for computing Landsat and covariates. bands and covariates are hardcoded inside the function.
+	fused=True computes the indices of each stack with a single array operation (see indices.getIndicesFused).
+	Static layers (JRC water, topography) are added once to the final stack, not per percentile stack"""
 	# hard coded for now
 	bands = ['blue','green','red','nir','swir1', 'swir2']	
 	bandLow = ['p20_blue','p20_green','p20_red','p20_nir','p20_swir1', 'p20_swir2']
@@ -305,9 +459,7 @@ def returnCovariates(img):
 		
 	def addIndices(img,prefix):
 		img = index.addAllTasselCapIndices(img)
-		img = index.getIndices(img,covariates)
-		img = index.addJRC(img).unmask(0)
-		img = index.addTopography(img).unmask(0)	
+		img = index.getIndices(img,covariates,fused)
 		if len(prefix) > 0:	
 			img = index.renameBands(img,prefix)
 		return img
@@ -319,8 +471,27 @@ def returnCovariates(img):
 		
 	img = down.addBands(middle).addBands(up)
 	
+	# time-invariant layers are the same for every percentile stack, attach them once
+	img = index.addJRC(img,aoi).unmask(0)
+	img = index.addTopography(img,aoi).unmask(0)
+	
 	return img
 
+def covariateBands(bands,**kwargs):
+	"""
+	Client-side band schema of an image after returnCovariatesFromOptions()
+	args:
+		bands (list[str]): band names of the input image (e.g. DATASET_BANDS['Landsat8'])
+		kwargs (dict): a settings dictionary
+	returns:
+		tuple(list[str],list[str]): indices that need computing and the output band names
+	"""
+	planned = indices().removeDuplicates(kwargs.get('indices',[]),bands)
+	outBands = list(bands) + planned
+	if kwargs.get('addTasselCap',False):
+		outBands += [b for b in tasseled_cap_bands(kwargs.get('tasselCapSensor')) if b not in outBands]
+	return planned, outBands
+
 # TODO: can't figure out how to detangle getIndices() and addAllTasselCapIndices() 
 # so that they can be directly passed as func to hf.Dataset.apply_func()
 # so we have this function that takes unnamed kwargs, passed to apply_func()..
@@ -334,16 +505,17 @@ def returnCovariatesFromOptions(img,**kwargs):
 		img (ee.Image): multi-band image with all desired covariates
 	"""
 	settings = kwargs
+	# declarative indices from settings, e.g. "formulas": {"NDVI": "(nir - red) / (nir + red)"}
+	index = indices(settings.get('formulas'))
 	if 'indices' in kwargs.keys():
 		if len(kwargs['indices']) > 0:
 			covariates = settings['indices']
-			index = indices()
 		
-		img = ee.Image(img)
-		img = index.getIndices(img,covariates)
+			img = ee.Image(img)
+			img = index.getIndices(img,covariates,settings.get('fuseIndices',False))
 	
 	if 'addTasselCap' in kwargs.keys():
 		if kwargs['addTasselCap']:
-			img = index.addAllTasselCapIndices(img)
+			img = index.addAllTasselCapIndices(img,settings.get('tasselCapSensor'))
 	
 	return img
\ No newline at end of file
@@ -0,0 +1,221 @@
+import ast
+import functools
+import numpy as np
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+# the rlcms.covariates.indices catalogue as declarative formulas.
+# normalized differences here do not mask negative inputs the way ee.Image.normalizedDifference() does
+INDEX_FORMULAS = {"ND_blue_green" : "(blue - green) / (blue + green)",
+                  "ND_blue_red" : "(blue - red) / (blue + red)",
+                  "ND_blue_nir" : "(blue - nir) / (blue + nir)",
+                  "ND_blue_swir1" : "(blue - swir1) / (blue + swir1)",
+                  "ND_blue_swir2" : "(blue - swir2) / (blue + swir2)",
+                  "ND_green_red" : "(green - red) / (green + red)",
+                  "ND_green_nir" : "(green - nir) / (green + nir)",
+                  "ND_green_swir1" : "(green - swir1) / (green + swir1)",
+                  "ND_green_swir2" : "(green - swir2) / (green + swir2)",
+                  "ND_red_swir1" : "(red - swir1) / (red + swir1)",
+                  "ND_red_swir2" : "(red - swir2) / (red + swir2)",
+                  "ND_nir_red" : "(nir - red) / (nir + red)",
+                  "ND_nir_swir1" : "(nir - swir1) / (nir + swir1)",
+                  "ND_nir_swir2" : "(nir - swir2) / (nir + swir2)",
+                  "ND_swir1_swir2" : "(swir1 - swir2) / (swir1 + swir2)",
+                  "R_swir1_nir" : "swir1 / nir",
+                  "R_red_swir1" : "red / swir1",
+                  "EVI" : "2.5 * ((nir - red) / (nir + 6 * red - 7.5 * blue + 1))",
+                  "SAVI" : "(nir - red) * (1 + 0.5) / (nir + red + 0.5)",
+                  "IBI" : "(2*swir1/(swir1 + nir) - (nir/(nir + red) + green/(green + swir1))) / "
+                          "(2*swir1/(swir1 + nir) + (nir/(nir + red) + green/(green + swir1)))"}
+
+_BINOPS = {ast.Add:'+', ast.Sub:'-', ast.Mult:'*', ast.Div:'/', ast.Pow:'**'}
+# functions allowed in formulas, supported by ee.Image.expression(), numexpr and numpy alike
+_FUNCTIONS = {'sqrt':np.sqrt, 'abs':np.abs, 'exp':np.exp, 'log':np.log}
+
+def _parse(formula:str):
+    """parse a formula string into a hashable tree of tuples, with commutative operands in canonical order"""
+    def visit(node):
+        if isinstance(node,ast.Expression):
+            return visit(node.body)
+        elif isinstance(node,ast.Name):
+            return ('band',node.id)
+        elif isinstance(node,ast.Constant) and isinstance(node.value,(int,float)) and not isinstance(node.value,bool):
+            return ('const',float(node.value))
+        elif isinstance(node,ast.UnaryOp) and isinstance(node.op,(ast.USub,ast.UAdd)):
+            operand = visit(node.operand)
+            if isinstance(node.op,ast.UAdd):
+                return operand
+            if operand[0] == 'const':
+                return ('const',-operand[1])
+            return ('neg',operand)
+        elif isinstance(node,ast.BinOp) and type(node.op) in _BINOPS:
+            op = _BINOPS[type(node.op)]
+            a,b = visit(node.left),visit(node.right)
+            if op in ('+','*'):
+                a,b = sorted([a,b],key=repr)
+            return (op,a,b)
+        elif (isinstance(node,ast.Call) and isinstance(node.func,ast.Name)
+              and node.func.id in _FUNCTIONS and len(node.args) == 1 and len(node.keywords) == 0):
+            return ('call',node.func.id,visit(node.args[0]))
+        raise ValueError(f"Unsupported syntax in formula {formula!r}: {ast.dump(node)}")
+    try:
+        tree = ast.parse(formula.strip(),mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Could not parse formula {formula!r}: {e}")
+    return visit(tree)
+
+def _children(node):
+    if node[0] in ('band','const'):
+        return []
+    elif node[0] == 'neg':
+        return [node[1]]
+    elif node[0] == 'call':
+        return [node[2]]
+    return [node[1],node[2]]
+
+class CompiledFormulas:
+    """
+    A set of formulas compiled once, with common subexpressions shared across all of them
+
+    Repeated subexpressions (e.g. `nir + red` used by both ND_nir_red and SAVI) become named temporaries
+    computed a single time. `steps` lists every temporary then every output in evaluation order as
+    (name, expression, referenced names, is_output), where expressions reference input bands and earlier
+    temporaries by name. The same steps drive ee.Image.expression() (see rlcms.covariates.indices.addFormulas)
+    and the local kernel in evaluate().
+    """
+    def __init__(self,formulas:dict):
+        if len(formulas) == 0:
+            raise ValueError("formulas must contain at least one {name: formula} entry")
+        self.names = list(formulas.keys())
+        trees = {name:_parse(f) for name,f in formulas.items()}
+
+        # count how often each compound subexpression occurs across all formulas
+        counts = {}
+        def count(node):
+            if node[0] in ('band','const'):
+                return
+            counts[node] = counts.get(node,0) + 1
+            if counts[node] == 1:
+                for c in _children(node):
+                    count(c)
+        for tree in trees.values():
+            count(tree)
+
+        def band_names(node):
+            if node[0] == 'band':
+                return {node[1]}
+            return set().union(*[band_names(c) for c in _children(node)])
+        self.bands = sorted(set().union(*[band_names(t) for t in trees.values()]))
+        prefix = 'tmp'
+        while any(b.startswith(prefix) for b in self.bands + self.names):
+            prefix = '_' + prefix
+
+        temporaries = {}
+        self.steps = []
+        def emit(node,top=False):
+            """expression string for node, registering shared subexpressions as temporaries"""
+            if node[0] == 'band':
+                return node[1],{node[1]}
+            elif node[0] == 'const':
+                return repr(node[1]) if node[1] >= 0 else f"({node[1]!r})",set()
+            if node in temporaries and not top:
+                return temporaries[node],{temporaries[node]}
+            if node[0] == 'neg':
+                e,refs = emit(node[1])
+                expression = f"(-{e})"
+            elif node[0] == 'call':
+                e,refs = emit(node[2])
+                expression = f"{node[1]}({e})"
+            else:
+                a,refs_a = emit(node[1])
+                b,refs_b = emit(node[2])
+                expression,refs = f"({a} {node[0]} {b})",refs_a | refs_b
+            if counts[node] > 1 and not top:
+                name = f"{prefix}{sum(not s[3] for s in self.steps)}"
+                temporaries[node] = name
+                self.steps.append((name,expression,sorted(refs),False))
+                return name,{name}
+            return expression,refs
+
+        for name,tree in trees.items():
+            if tree in temporaries:
+                expression,refs = temporaries[tree],[temporaries[tree]]
+            else:
+                expression,refs = emit(tree,top=True)
+                if counts.get(tree,0) > 1:
+                    # this whole formula is reused by another one, keep it as a temporary too
+                    temporaries[tree] = name
+            self.steps.append((name,expression,sorted(refs),True))
+
+        self.temporaries = [s[0] for s in self.steps if not s[3]]
+        self._code = {s[0]:compile(s[1],f"<formula {s[0]}>",'eval') for s in self.steps}
+
+    def evaluate(self,
+                 stack,
+                 bands:list,
+                 out=None,
+                 chunk_size:int=256):
+        """
+        Evaluate all formulas on a local (band, y, x) array in one chunked pass
+
+        Uses numexpr when installed (fused, multi-threaded kernels writing straight into `out`),
+        otherwise numpy.
+
+        args:
+            stack (np.ndarray|np.memmap): array shaped (band, y, x)
+            bands (list[str]): band names of the first axis of `stack`
+            out (np.ndarray|np.memmap): Optional, preallocated float32 output shaped (len(names), y, x)
+            chunk_size (int): number of rows processed per block. Default = 256
+        returns:
+            np.ndarray|np.memmap: (len(names), y, x) float32 array, bands in the order of `names`
+        """
+        missing = [b for b in self.bands if b not in bands]
+        if len(missing) > 0:
+            raise ValueError(f"stack is missing bands required by the formulas: {missing}")
+        if stack.ndim != 3 or stack.shape[0] != len(bands):
+            raise ValueError(f"stack must be shaped (band, y, x) with {len(bands)} bands, got: {stack.shape}")
+
+        _,ny,nx = stack.shape
+        if out is None:
+            out = np.empty((len(self.names),ny,nx),dtype=np.float32)
+        elif out.shape != (len(self.names),ny,nx):
+            raise ValueError(f"out must be shaped {(len(self.names),ny,nx)}, got: {out.shape}")
+
+        band_index = {b:i for i,b in enumerate(bands)}
+        output_index = {n:i for i,n in enumerate(self.names)}
+        rows = min(chunk_size,ny)
+        scratch = {t:np.empty((rows,nx),dtype=np.float32) for t in self.temporaries}
+
+        with np.errstate(divide='ignore',invalid='ignore'):
+            for r0 in range(0,ny,rows):
+                r1 = min(r0+rows,ny)
+                values = {b:np.asarray(stack[band_index[b],r0:r1,:],dtype=np.float32) for b in self.bands}
+                for name,expression,refs,is_output in self.steps:
+                    target = out[output_index[name],r0:r1,:] if is_output else scratch[name][:r1-r0]
+                    local = {r:values[r] for r in refs}
+                    if numexpr is not None:
+                        numexpr.evaluate(expression,local_dict=local,out=target,casting='unsafe')
+                    else:
+                        np.copyto(target,eval(self._code[name],dict(_FUNCTIONS),local),casting='unsafe')
+                    values[name] = target
+        return out
+
+@functools.lru_cache(maxsize=128)
+def _compile(items:tuple):
+    return CompiledFormulas(dict(items))
+
+def compile_formulas(formulas:dict):
+    """
+    Compile a {name: formula} dictionary, e.g. {'NDVI': '(nir - red) / (nir + red)'}, into CompiledFormulas.
+    Formulas use band names as variables, numeric constants, + - * / ** and sqrt(), abs(), exp(), log().
+    Compiled results are cached, so calling this repeatedly with the same formulas is cheap.
+
+    args:
+        formulas (dict): output band name -> formula string
+    returns:
+        CompiledFormulas
+    """
+    return _compile(tuple(formulas.items()))
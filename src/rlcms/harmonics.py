@@ -1,8 +1,13 @@
 import ee
 import math
+from rlcms.covariates import DATASET_BANDS
 
 ee.Initialize()
 
+# raw bands of the supported datasets, masked together by the dataset's QA/cloud mask, so they can share one regression.
+# other bands (e.g. normalizedDifference() indices masking negative inputs) may be masked on their own
+SHARED_MASK_BANDS = sorted(set(b for bands in DATASET_BANDS.values() for b in bands))
+
 def addHarmonicTerms(image):
     """add Time bands to image"""
     timeRadians = image.select("t").multiply(2 * math.pi)
@@ -45,6 +50,34 @@ def calculateHarmonic(imageCollection: ee.ImageCollection, dependent: ee.String)
     return ee.Image.cat(phase, amplitude)
 
 
+def calculateHarmonics(imageCollection: ee.ImageCollection, dependents: list):
+    """
+    Calculate harmonic coefficients (phase and amplitude) of several bands with one regression
+    imageCollection: ImageCollection with time bands (see addTimeConstant)
+    dependents: list of band names that you fit the harmonic model for, must be contained in ImageCollection.
+        linearRegression drops a scene for every dependent if any one of them is masked, so the bands must 
+        share a mask to get the same fit as calculateHarmonic per band
+    returns ee.Image with bands [band_phase, band_amplitude] for each band in dependents order
+    """
+    harmonicIndependents = ["constant", "t", "cos", "sin"]
+    harmonicCollection = imageCollection.map(addHarmonicTerms)
+    # all dependents share the design, the output is a 4 x len(dependents) array image
+    harmonicTrend = harmonicCollection.select(harmonicIndependents + dependents).reduce(
+        ee.Reducer.linearRegression(len(harmonicIndependents), len(dependents))
+    )
+    coefficients = harmonicTrend.select("coefficients")
+
+    # rows 2 and 3 hold the cos and sin coefficients, one column per dependent
+    cos = coefficients.arraySlice(0, 2, 3).arrayProject([1]).arrayFlatten([dependents])
+    sin = coefficients.arraySlice(0, 3, 4).arrayProject([1]).arrayFlatten([dependents])
+
+    phase = cos.atan2(sin).rename([f"{b}_phase" for b in dependents])
+    amplitude = cos.hypot(sin).rename([f"{b}_amplitude" for b in dependents])
+    return ee.Image.cat(phase, amplitude).select(
+        [f"{b}_{suffix}" for b in dependents for suffix in ("phase", "amplitude")]
+    )
+
+
 def harmonicRGB(harmonics: ee.Image):
     """Use the HSV to RGB transform to display phase and amplitude"""
     amplitude = harmonics.select(".*amplitude")
@@ -98,41 +131,35 @@ def doHarmonicsFromOptions(imgColl:ee.ImageCollection,**kwargs):
     harmonicsOptions = kwargs['harmonicsOptions']
 
     # get harmonicsOptions dictionary
-    if isinstance(harmonicsOptions,dict):
-    
-        # get band keys as list
-        bands = ee.Dictionary(harmonicsOptions).keys()
-        
-        def harmonicByBand(band):
-            band = ee.String(band)
-            # get the params for that band
-            bandwiseParams = ee.Dictionary(harmonicsOptions).get(band)
-            
-            # get the start and end DOY parameters
-            start = ee.Dictionary(bandwiseParams).get('start')
-            end = ee.Dictionary(bandwiseParams).get('end')
-            
-            # create temporal filtered imgColl for that band
-            imgCollByBand = (ee.ImageCollection(imgColl)
-                                .select(band)
-                                .filter(ee.Filter.dayOfYear(start,end)))
-            # add time bands
-            timeField = "system:time_start"
-            timeCollection = addTimeConstant(imgCollByBand, timeField)
-        
-            return ee.Image(calculateHarmonic(timeCollection,band))
-    else:
+    if not isinstance(harmonicsOptions,dict):
         raise TypeError(f"harmonicsOptions expects dict type, got: {type(harmonicsOptions)}")
     
-    # do harmonics by band key in model_inputs dictionary
-    listOfImages = ee.Image.cat(ee.List(bands).map(harmonicByBand))
-    bandStack = ee.Image(ee.ImageCollection.fromImages(listOfImages).toBands())
+    # group bands sharing the same DOY window client-side, so the collection is filtered 
+    # and given time bands once per window rather than once per band
+    windows = {}
+    for band in sorted(harmonicsOptions):
+        window = (harmonicsOptions[band]['start'],harmonicsOptions[band]['end'])
+        windows.setdefault(window,[]).append(band)
+    
+    timeField = "system:time_start"
+    harmonics = []
+    for (start,end),bands in windows.items():
+        # create temporal filtered imgColl for the window's bands
+        imgCollByWindow = (imgColl.select(bands)
+                                  .filter(ee.Filter.dayOfYear(start,end)))
+        # add time bands
+        timeCollection = addTimeConstant(imgCollByWindow, timeField)
+        # bands sharing the dataset mask are fit in one regression, any other band on its own scenes
+        shared = [b for b in bands if b in SHARED_MASK_BANDS]
+        if len(shared) > 0:
+            harmonics.append(calculateHarmonics(timeCollection,shared))
+        for band in bands:
+            if band not in shared:
+                harmonics.append(calculateHarmonics(timeCollection,[band]))
     
-    # to remove srcImg band name indexing resulting from .toBands() 
-    # (i.e. [0_swir1_phase, 0_swir1_amplitude] -> [swir1_phase, swir1_amplitude] )
-    bandNames = bandStack.bandNames()
-    fixedBandNames = bandNames.map(lambda e: ee.String(e).split("_").slice(-2).join("_"))
-    return bandStack.rename(fixedBandNames)
+    # bands in sorted order, matching ee.Dictionary(harmonicsOptions).keys()
+    bandNames = [f"{b}_{suffix}" for b in sorted(harmonicsOptions) for suffix in ("phase","amplitude")]
+    return ee.Image.cat(harmonics).select(bandNames)
 
 if __name__ == "__main__":
     # inputs
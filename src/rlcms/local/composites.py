@@ -0,0 +1,267 @@
+import re
+import warnings
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from rlcms.temporal import agg_timing, bin_dates
+
+def _parse_reducer(reducer:str):
+    """reducer name -> ('mean'|'min'|'max', None) or ('percentile', q in [0,1]). 'median' is 'p50' """
+    if reducer in ('mean','min','max'):
+        return reducer,None
+    if reducer == 'median':
+        return 'percentile',0.5
+    match = re.fullmatch(r'p(\d{1,3})',reducer)
+    if match and int(match.group(1)) <= 100:
+        return 'percentile',int(match.group(1))/100
+    raise ValueError(f"Unsupported reducer: {reducer}. Use 'mean', 'median', 'min', 'max' or a percentile like 'p20'")
+
+def nan_quantiles(values,qs):
+    """
+    NaN-aware quantiles along the first axis with linear interpolation (same as np.nanpercentile)
+
+    Pixels without missing values share one np.partition call on the few ranks needed; only pixels
+    with missing values fall back to a sort, since their ranks differ per pixel.
+
+    args:
+        values (np.ndarray): array shaped (n, pixels)
+        qs (list[float]): quantiles between 0 and 1
+    returns:
+        np.ndarray: float32 array shaped (len(qs), pixels), NaN where a pixel has no valid values
+    """
+    values = np.asarray(values,dtype=np.float32)
+    n,p = values.shape
+    qs = np.asarray(qs,dtype=np.float64)
+    out = np.full((len(qs),p),np.nan,dtype=np.float32)
+    if n == 0 or p == 0:
+        return out
+
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=0)
+    full = counts == n
+
+    def interpolate(ordered,counts):
+        pos = qs[:,None]*(counts[None,:]-1)
+        lo = np.floor(pos).astype(np.intp)
+        hi = np.minimum(lo+1,np.maximum(counts-1,0)[None,:])
+        frac = (pos-lo).astype(np.float32)
+        lo_v = np.take_along_axis(ordered,lo,axis=0)
+        hi_v = np.take_along_axis(ordered,hi,axis=0)
+        return lo_v + (hi_v-lo_v)*frac
+
+    if full.any():
+        pos = qs*(n-1)
+        kth = np.unique(np.concatenate([np.floor(pos),np.minimum(np.floor(pos)+1,n-1)]).astype(np.intp))
+        ordered = np.partition(values[:,full],kth,axis=0)
+        out[:,full] = interpolate(ordered,np.full(int(full.sum()),n))
+    partial = ~full & (counts > 0)
+    if partial.any():
+        # np.sort places NaNs last, so the first counts[i] values of each pixel are its valid ones
+        ordered = np.sort(values[:,partial],axis=0)
+        out[:,partial] = interpolate(ordered,counts[partial])
+    return out
+
+class HistogramSketch:
+    """
+    Fixed-size per-pixel histogram for single-pass approximate percentiles
+
+    Scenes are folded in one at a time with update(), memory stays at `bins` counters per pixel no matter
+    how many scenes are added, and any set of percentiles can be read at the end. Values are binned over
+    `value_range` (values outside are clipped to the edge bins), so estimates are within one bin width
+    (value_range span / bins) of the exact linear-interpolated percentile.
+
+    args:
+        shape (tuple): shape of each scene, e.g. (band, y, x)
+        value_range (tuple(float,float)): (min, max) of the values being sketched
+        bins (int): histogram bins per pixel. Default = 256
+    """
+    def __init__(self,shape:tuple,value_range:tuple,bins:int=256):
+        lo,hi = value_range
+        if not hi > lo:
+            raise ValueError(f"value_range must be (min, max) with max > min, got: {value_range}")
+        self.shape = tuple(shape)
+        self.lo = float(lo)
+        self.width = (float(hi)-float(lo))/bins
+        self.bins = bins
+        n_pixels = int(np.prod(self.shape))
+        self.counts = np.zeros((n_pixels,bins),dtype=np.uint16)
+        self.n = np.zeros(n_pixels,dtype=np.uint16)
+        self._pixels = np.arange(n_pixels)
+
+    def update(self,scene):
+        """fold one scene shaped like `shape` into the sketch, NaN values are ignored"""
+        values = np.asarray(scene,dtype=np.float32).reshape(-1)
+        if values.size != self.counts.shape[0]:
+            raise ValueError(f"scene must be shaped {self.shape}, got: {np.shape(scene)}")
+        valid = ~np.isnan(values)
+        idx = np.clip(((values[valid]-self.lo)/self.width).astype(np.intp),0,self.bins-1)
+        # one increment per pixel, so fancy-indexed += has no repeated (pixel, bin) pairs
+        self.counts[self._pixels[valid],idx] += 1
+        self.n[valid] += 1
+
+    def percentiles(self,qs):
+        """
+        approximate percentiles of every pixel
+        args:
+            qs (list[float]): quantiles between 0 and 1
+        returns:
+            np.ndarray: float32 array shaped (len(qs), *shape), NaN where a pixel had no valid values
+        """
+        qs = np.asarray(qs,dtype=np.float64)
+        has = self.n > 0
+        counts = self.counts[has]
+        cum = np.cumsum(counts,axis=1,dtype=np.int32)
+        n = self.n[has].astype(np.float64)
+        rows = np.arange(counts.shape[0])
+
+        def order_statistic(k):
+            """estimated k-th smallest value (0-based) of each pixel, assuming values spread evenly within a bin"""
+            idx = np.minimum((cum <= k[:,None]).sum(axis=1),self.bins-1)
+            before = np.where(idx > 0,cum[rows,np.maximum(idx-1,0)],0)
+            in_bin = np.maximum(counts[rows,idx],1)
+            return self.lo + (idx + np.clip((k-before+0.5)/in_bin,0,1))*self.width
+
+        out = np.full((len(qs),self.counts.shape[0]),np.nan,dtype=np.float32)
+        for i,q in enumerate(qs):
+            # linear interpolation between order statistics, as np.percentile's default method
+            rank = q*(n-1)
+            k0 = np.floor(rank)
+            k1 = np.minimum(k0+1,n-1)
+            v0,v1 = order_statistic(k0),order_statistic(k1)
+            out[i,has] = v0 + (v1-v0)*(rank-k0)
+        return out.reshape((len(qs),)+self.shape)
+
+def composite_bands(bands:list,reducers:list,n_periods:int):
+    """band names of composite_cube() output, following rlcms.Composite naming (t{i}_ prefix if more than one period)"""
+    names = [f"{b}_{r}" for b in bands for r in reducers]
+    if n_periods > 1:
+        return [f"t{i}_{n}" for i in range(n_periods) for n in names]
+    return names
+
+def composite_cube(cube,
+                   dates,
+                   bands:list,
+                   start_date:str,
+                   end_date:str,
+                   composite_mode:str='annual',
+                   season:list=None,
+                   reducers:list=['mean'],
+                   out=None,
+                   chunk_size:int=64,
+                   max_workers:int=None,
+                   approximate:bool=False,
+                   value_range:tuple=None,
+                   bins:int=256):
+    """
+    Annual or seasonal composites of a local time-stacked scene cube, the local counterpart of rlcms.Composite
+
+    Periods follow rlcms.composites.get_agg_timing, keeping only periods that contain scenes. Masked
+    pixels are NaN and ignored by every reducer. Blocks of rows are reduced in a thread pool, each block
+    reading only its own rows of the cube, so memory is bounded by chunk_size and max_workers.
+
+    With approximate=True every period is reduced in a single pass that reads one scene at a time:
+    percentiles come from a HistogramSketch and mean/min/max from running totals, so memory no longer
+    grows with the number of scenes per period.
+
+    args:
+        cube (np.ndarray|np.memmap): array shaped (time, band, y, x), NaN where masked
+        dates (list[str]|np.ndarray): acquisition date of each scene along the time axis
+        bands (list[str]): band names of the band axis
+        start_date (str): start date
+        end_date (str): end date
+        composite_mode (str): one of 'annual' or 'seasonal', Default = 'annual'
+        season (list[str|int]): consecutive list of months comprising the season, required if composite_mode == 'seasonal'
+        reducers (list[str]): any of 'mean', 'median', 'min', 'max' or percentiles like 'p20'. Default = ['mean']
+        out (np.ndarray|np.memmap): Optional, preallocated float32 output shaped (len(band names), y, x)
+        chunk_size (int): number of rows reduced per task. Default = 64
+        max_workers (int): number of threads. Default = ThreadPoolExecutor default
+        approximate (bool): single-pass approximate reduction, Default = False
+        value_range (tuple(float,float)): (min, max) of the cube's values, required if approximate
+        bins (int): histogram bins per pixel if approximate. Default = 256
+    returns:
+        tuple(np.ndarray|np.memmap, list[str]): composite stack shaped (band, y, x) and its band names
+    """
+    if cube.ndim != 4 or cube.shape[1] != len(bands):
+        raise ValueError(f"cube must be shaped (time, band, y, x) with {len(bands)} bands, got: {cube.shape}")
+    if len(dates) != cube.shape[0]:
+        raise ValueError(f"got {len(dates)} dates for {cube.shape[0]} scenes")
+    parsed = [_parse_reducer(r) for r in reducers]
+
+    period,period_unit,starts = agg_timing(start_date,end_date,composite_mode,season,scene_dates=dates)
+    period_index = bin_dates(dates,starts,period=period,period_unit=period_unit)
+    members = [np.flatnonzero(period_index == i) for i in range(len(starts))]
+
+    names = composite_bands(bands,reducers,len(starts))
+    _,nb,ny,nx = cube.shape
+    if out is None:
+        out = np.empty((len(names),ny,nx),dtype=np.float32)
+    elif out.shape != (len(names),ny,nx):
+        raise ValueError(f"out must be shaped {(len(names),ny,nx)}, got: {out.shape}")
+
+    quantiles = [q for kind,q in parsed if kind == 'percentile']
+    nr = len(reducers)
+    if approximate and value_range is None:
+        raise ValueError("value_range is required if approximate=True")
+
+    def reduce_streaming(block,scenes):
+        """one pass over the scenes of a period, holding a single scene of the block at a time"""
+        shape = (nb,block.shape[2],nx)
+        sketch = HistogramSketch(shape,value_range,bins) if len(quantiles) > 0 else None
+        total = np.zeros(shape,dtype=np.float64)
+        count = np.zeros(shape,dtype=np.int32)
+        low = np.full(shape,np.inf,dtype=np.float32)
+        high = np.full(shape,-np.inf,dtype=np.float32)
+        for t in scenes:
+            scene = np.asarray(block[t],dtype=np.float32)
+            valid = ~np.isnan(scene)
+            if sketch is not None:
+                sketch.update(scene)
+            np.add(total,scene,out=total,where=valid)
+            count += valid
+            np.fmin(low,scene,out=low)
+            np.fmax(high,scene,out=high)
+        empty = count == 0
+        results = {('mean',None):np.where(empty,np.nan,total/np.maximum(count,1)).reshape(-1),
+                   ('min',None):np.where(empty,np.nan,low).reshape(-1),
+                   ('max',None):np.where(empty,np.nan,high).reshape(-1)}
+        if sketch is not None:
+            qvalues = sketch.percentiles(quantiles).reshape(len(quantiles),-1)
+            for k,q in enumerate(quantiles):
+                results[('percentile',q)] = qvalues[k]
+        return results
+
+    def reduce_block(r0,r1):
+        block = cube[:,:,r0:r1,:]
+        for i,scenes in enumerate(members):
+            if approximate:
+                results = reduce_streaming(block,scenes)
+                for k,key in enumerate(parsed):
+                    result = results[key].reshape(nb,r1-r0,nx)
+                    for b in range(nb):
+                        out[i*nb*nr + b*nr + k,r0:r1,:] = result[b]
+                continue
+            values = np.asarray(block[scenes],dtype=np.float32).reshape(len(scenes),-1)
+            results = {}
+            with warnings.catch_warnings(), np.errstate(invalid='ignore',divide='ignore'):
+                warnings.simplefilter('ignore',RuntimeWarning)
+                if len(quantiles) > 0:
+                    qvalues = nan_quantiles(values,quantiles)
+                    for k,q in enumerate(quantiles):
+                        results[('percentile',q)] = qvalues[k]
+                if ('mean',None) in parsed:
+                    results[('mean',None)] = np.nanmean(values,axis=0)
+                if ('min',None) in parsed:
+                    results[('min',None)] = np.nanmin(values,axis=0)
+                if ('max',None) in parsed:
+                    results[('max',None)] = np.nanmax(values,axis=0)
+            for k,key in enumerate(parsed):
+                # results are band-major (band, rows, x) once reshaped
+                result = results[key].reshape(nb,r1-r0,nx)
+                for b in range(nb):
+                    out[i*nb*nr + b*nr + k,r0:r1,:] = result[b]
+        return r0,r1
+
+    windows = [(r0,min(r0+chunk_size,ny)) for r0 in range(0,ny,chunk_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for f in [executor.submit(reduce_block,r0,r1) for r0,r1 in windows]:
+            f.result()
+    return out,names
@@ -0,0 +1,281 @@
+import numpy as np
+
+# band order expected along the first axis of a local (band, y, x) stack,
+# same names hydrafloods optical datasets use
+BANDS = ['blue','green','red','nir','swir1','swir2']
+
+# local equivalents of rlcms.covariates.indices().functionList, in the same order.
+# each entry is (kind, input bands)
+INDICES = {"ND_blue_green" : ('nd',['blue','green']),
+           "ND_blue_red" : ('nd',['blue','red']),
+           "ND_blue_nir" : ('nd',['blue','nir']),
+           "ND_blue_swir1" : ('nd',['blue','swir1']),
+           "ND_blue_swir2" : ('nd',['blue','swir2']),
+           "ND_green_red" : ('nd',['green','red']),
+           "ND_green_nir" : ('nd',['green','nir']),
+           "ND_green_swir1" : ('nd',['green','swir1']),
+           "ND_green_swir2" : ('nd',['green','swir2']),
+           "ND_red_swir1" : ('nd',['red','swir1']),
+           "ND_red_swir2" : ('nd',['red','swir2']),
+           "ND_nir_red" : ('nd',['nir','red']),
+           "ND_nir_swir1" : ('nd',['nir','swir1']),
+           "ND_nir_swir2" : ('nd',['nir','swir2']),
+           "ND_swir1_swir2" : ('nd',['swir1','swir2']),
+           "R_swir1_nir" : ('ratio',['swir1','nir']),
+           "R_red_swir1" : ('ratio',['red','swir1']),
+           "EVI" : ('evi',['nir','red','blue']),
+           "SAVI" : ('savi',['nir','red']),
+           "IBI" : ('ibi',['swir1','nir','red','green'])}
+
+def _nd(a,b,o,scratch,mask):
+    """(a-b)/(a+b) into o, masked (NaN) where either input is negative like ee.Image.normalizedDifference()"""
+    np.subtract(a,b,out=o)
+    np.add(a,b,out=scratch[0])
+    np.divide(o,scratch[0],out=o)
+    np.less(a,0,out=mask[0])
+    np.less(b,0,out=mask[1])
+    np.logical_or(mask[0],mask[1],out=mask[0])
+    np.copyto(o,np.nan,where=mask[0])
+
+def _ratio(a,b,o,scratch,mask):
+    np.divide(a,b,out=o)
+
+def _evi(nir,red,blue,o,scratch,mask):
+    """2.5 * ((NIR - RED) / (NIR + 6 * RED - 7.5 * BLUE + 1))"""
+    np.multiply(red,6,out=scratch[0])
+    np.add(scratch[0],nir,out=scratch[0])
+    np.multiply(blue,7.5,out=o)
+    np.subtract(scratch[0],o,out=scratch[0])
+    np.add(scratch[0],1,out=scratch[0])
+    np.subtract(nir,red,out=o)
+    np.divide(o,scratch[0],out=o)
+    np.multiply(o,2.5,out=o)
+
+def _savi(nir,red,o,scratch,mask):
+    """(NIR - RED) * (1 + 0.5)/(NIR + RED + 0.5)"""
+    np.add(nir,red,out=scratch[0])
+    np.add(scratch[0],0.5,out=scratch[0])
+    np.subtract(nir,red,out=o)
+    np.multiply(o,1.5,out=o)
+    np.divide(o,scratch[0],out=o)
+
+def _ibi(swir1,nir,red,green,o,scratch,mask):
+    """normalized difference of IBI_A = 2*SWIR1/(SWIR1 + NIR) and IBI_B = (NIR/(NIR + RED)) + (GREEN/(GREEN + SWIR1))"""
+    ibi_a, ibi_b = scratch[0], scratch[1]
+    np.add(swir1,nir,out=ibi_a)
+    np.divide(swir1,ibi_a,out=ibi_a)
+    np.multiply(ibi_a,2,out=ibi_a)
+    np.add(nir,red,out=ibi_b)
+    np.divide(nir,ibi_b,out=ibi_b)
+    np.add(green,swir1,out=o)
+    np.divide(green,o,out=o)
+    np.add(ibi_b,o,out=ibi_b)
+    _nd(ibi_a,ibi_b,o,scratch[2:],mask)
+
+_KERNELS = {'nd':_nd,
+            'ratio':_ratio,
+            'evi':_evi,
+            'savi':_savi,
+            'ibi':_ibi}
+
+def compute_indices(stack,
+                    indices:list=None,
+                    bands:list=BANDS,
+                    out=None,
+                    chunk_size:int=256):
+    """
+    Compute any subset of the rlcms.covariates.indices catalogue on a local array in one chunked pass
+
+    Mirrors the band math of the Earth Engine methods so tiles can be scored offline without a
+    second hand-ported copy. All requested indices are computed per block of rows, written directly
+    into `out` with a fixed set of per-block scratch buffers (no per-index temporaries).
+
+    args:
+        stack (np.ndarray|np.memmap): float32 array shaped (band, y, x) of surface reflectance
+        indices (list[str]): index names, keys of INDICES. Default = all of them
+        bands (list[str]): band names of the first axis of `stack`. Default = BANDS
+        out (np.ndarray|np.memmap): Optional, preallocated float32 output shaped (len(indices), y, x)
+        chunk_size (int): number of rows processed per block. Default = 256
+    returns:
+        np.ndarray|np.memmap: (len(indices), y, x) float32 array, bands in the order of `indices`
+    """
+    if indices is None:
+        indices = list(INDICES.keys())
+    unknown = [i for i in indices if i not in INDICES]
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown indices: {unknown}. Choose from: {list(INDICES.keys())}")
+
+    if stack.ndim != 3 or stack.shape[0] != len(bands):
+        raise ValueError(f"stack must be shaped (band, y, x) with {len(bands)} bands, got: {stack.shape}")
+    missing = sorted(set(b for i in indices for b in INDICES[i][1]) - set(bands))
+    if len(missing) > 0:
+        raise ValueError(f"stack is missing bands required by {indices}: {missing}")
+    band_index = {b:i for i,b in enumerate(bands)}
+
+    _,ny,nx = stack.shape
+    if out is None:
+        out = np.empty((len(indices),ny,nx),dtype=np.float32)
+    elif out.shape != (len(indices),ny,nx):
+        raise ValueError(f"out must be shaped {(len(indices),ny,nx)}, got: {out.shape}")
+
+    rows = min(chunk_size,ny)
+    scratch = [np.empty((rows,nx),dtype=np.float32) for _ in range(3)]
+    mask = [np.empty((rows,nx),dtype=bool) for _ in range(2)]
+
+    with np.errstate(divide='ignore',invalid='ignore'):
+        for r0 in range(0,ny,rows):
+            r1 = min(r0+rows,ny)
+            n = r1-r0
+            block = np.asarray(stack[:,r0:r1,:],dtype=np.float32)
+            s = [a[:n] for a in scratch]
+            m = [a[:n] for a in mask]
+            for k,name in enumerate(indices):
+                kind,inputs = INDICES[name]
+                args = [block[band_index[b]] for b in inputs]
+                _KERNELS[kind](*args,out[k,r0:r1,:],s,m)
+    return out
+
+# tasseled cap coefficients for ['blue','green','red','nir','swir1','swir2'] by sensor.
+# Landsat5: Crist (1985) TM reflectance factors, the set rlcms.covariates has always used
+# Landsat7: Huang et al. (2002) ETM+ at-satellite reflectance
+# Landsat8/Landsat9: Baig et al. (2014) OLI at-satellite reflectance
+# Sentinel2: Shi & Xu (2019) MSI, brightness/greenness/wetness only
+TASSELED_CAP_COEFFICIENTS = {
+    'Landsat5':[[0.3037, 0.2793, 0.4743, 0.5585, 0.5082, 0.1863],
+                [-0.2848, -0.2435, -0.5436, 0.7243, 0.0840, -0.1800],
+                [0.1509, 0.1973, 0.3279, 0.3406, -0.7112, -0.4572],
+                [-0.8242, 0.0849, 0.4392, -0.0580, 0.2012, -0.2768],
+                [-0.3280, 0.0549, 0.1075, 0.1855, -0.4357, 0.8085],
+                [0.1084, -0.9022, 0.4120, 0.0573, -0.0251, 0.0238]],
+    'Landsat7':[[0.3561, 0.3972, 0.3904, 0.6966, 0.2286, 0.1596],
+                [-0.3344, -0.3544, -0.4556, 0.6966, -0.0242, -0.2630],
+                [0.2626, 0.2141, 0.0926, 0.0656, -0.7629, -0.5388],
+                [0.0805, -0.0498, 0.1950, -0.1327, 0.5752, -0.7775],
+                [-0.7252, -0.0202, 0.6683, 0.0631, -0.1494, -0.0274],
+                [0.4000, -0.8172, 0.3832, 0.0602, -0.1095, 0.0985]],
+    'Landsat8':[[0.3029, 0.2786, 0.4733, 0.5599, 0.5080, 0.1872],
+                [-0.2941, -0.2430, -0.5424, 0.7276, 0.0713, -0.1608],
+                [0.1511, 0.1973, 0.3283, 0.3407, -0.7117, -0.4559],
+                [-0.8239, 0.0849, 0.4396, -0.0580, 0.2013, -0.2773],
+                [-0.3294, 0.0557, 0.1056, 0.1855, -0.4349, 0.8085],
+                [0.1079, -0.9023, 0.4119, 0.0575, -0.0259, 0.0252]],
+    'Sentinel2':[[0.3510, 0.3813, 0.3437, 0.7196, 0.2396, 0.1949],
+                 [-0.3599, -0.3533, -0.4734, 0.6633, 0.0087, -0.2856],
+                 [0.2578, 0.2305, 0.0883, 0.1071, -0.7611, -0.5308]],
+}
+TASSELED_CAP_COEFFICIENTS['Landsat9'] = TASSELED_CAP_COEFFICIENTS['Landsat8']
+
+TASSELED_CAP_COMPONENTS = ['brightness','greenness','wetness','fourth','fifth','sixth']
+# (name, first component, second component) of the angle and distance bands
+TASSELED_CAP_ANGLES = [('tcAngleBG','brightness','greenness'),
+                       ('tcAngleGW','greenness','wetness'),
+                       ('tcAngleBW','brightness','wetness')]
+TASSELED_CAP_DISTANCES = [('tcDistBG','brightness','greenness'),
+                          ('tcDistGW','greenness','wetness'),
+                          ('tcDistBW','brightness','wetness')]
+
+def tasseled_cap_coefficients(sensor:str=None):
+    """coefficient table (list of rows over BANDS) for a sensor, default 'Landsat5'"""
+    sensor = 'Landsat5' if sensor is None else sensor
+    if sensor not in TASSELED_CAP_COEFFICIENTS:
+        raise ValueError(f"No tasseled cap coefficients for {sensor}. Choose from: {list(TASSELED_CAP_COEFFICIENTS.keys())}")
+    return TASSELED_CAP_COEFFICIENTS[sensor]
+
+def tasseled_cap_bands(sensor:str=None):
+    """output band names of tasseled_cap() (and rlcms.covariates.indices.addAllTasselCapIndices) for a sensor"""
+    n = len(tasseled_cap_coefficients(sensor))
+    return (TASSELED_CAP_COMPONENTS[:n]
+            + [a[0] for a in TASSELED_CAP_ANGLES]
+            + [d[0] for d in TASSELED_CAP_DISTANCES])
+
+def tasseled_cap(stack,
+                 sensor:str=None,
+                 bands:list=BANDS,
+                 out=None,
+                 chunk_size:int=256):
+    """
+    Tasseled cap components, angles and distances of a local array in one chunked pass
+
+    Each block of rows is transformed with a single matrix multiply of the coefficient table against
+    all of its pixels, then the angle and distance bands are derived from the components in place.
+    Angles are divided by pi, as in rlcms.covariates.indices.addAllTasselCapIndices.
+
+    args:
+        stack (np.ndarray|np.memmap): float32 array shaped (band, y, x) of surface reflectance
+        sensor (str): coefficient set, one of TASSELED_CAP_COEFFICIENTS keys. Default = 'Landsat5'
+        bands (list[str]): band names of the first axis of `stack`, must include BANDS. Default = BANDS
+        out (np.ndarray|np.memmap): Optional, preallocated float32 output shaped (len(tasseled_cap_bands(sensor)), y, x)
+        chunk_size (int): number of rows processed per block. Default = 256
+    returns:
+        np.ndarray|np.memmap: float32 array, bands in the order of tasseled_cap_bands(sensor)
+    """
+    coefficients = np.asarray(tasseled_cap_coefficients(sensor),dtype=np.float32)
+    names = tasseled_cap_bands(sensor)
+    n = coefficients.shape[0]
+
+    missing = [b for b in BANDS if b not in bands]
+    if len(missing) > 0:
+        raise ValueError(f"stack is missing bands required by the tasseled cap transform: {missing}")
+    if stack.ndim != 3 or stack.shape[0] != len(bands):
+        raise ValueError(f"stack must be shaped (band, y, x) with {len(bands)} bands, got: {stack.shape}")
+
+    # place coefficients at the positions of the stack's bands so the whole block is multiplied at once
+    matrix = np.zeros((n,len(bands)),dtype=np.float32)
+    for i,b in enumerate(BANDS):
+        matrix[:,bands.index(b)] = coefficients[:,i]
+
+    _,ny,nx = stack.shape
+    if out is None:
+        out = np.empty((len(names),ny,nx),dtype=np.float32)
+    elif out.shape != (len(names),ny,nx):
+        raise ValueError(f"out must be shaped {(len(names),ny,nx)}, got: {out.shape}")
+
+    component = {c:i for i,c in enumerate(TASSELED_CAP_COMPONENTS[:n])}
+    rows = min(chunk_size,ny)
+    for r0 in range(0,ny,rows):
+        r1 = min(r0+rows,ny)
+        block = np.asarray(stack[:,r0:r1,:],dtype=np.float32)
+        np.einsum('cb,byx->cyx',matrix,block,out=out[:n,r0:r1,:],optimize=True)
+        for k,(_,a,b) in enumerate(TASSELED_CAP_ANGLES):
+            o = out[n+k,r0:r1,:]
+            np.arctan2(out[component[a],r0:r1,:],out[component[b],r0:r1,:],out=o)
+            np.divide(o,np.pi,out=o)
+        for k,(_,a,b) in enumerate(TASSELED_CAP_DISTANCES):
+            np.hypot(out[component[a],r0:r1,:],out[component[b],r0:r1,:],out=out[n+len(TASSELED_CAP_ANGLES)+k,r0:r1,:])
+    return out
+
+TOPOGRAPHY_BANDS = ['slope','aspect','eastness','northness']
+
+def topography(elevation,
+               pixel_size:float,
+               out=None):
+    """
+    Slope, aspect, eastness and northness of a local elevation array, like rlcms.covariates.topography()
+
+    Gradients use the 4-connected neighbors of each pixel (as ee.Algorithms.Terrain does), with edge
+    pixels replicated. Rows are assumed to run north to south. Slope is between 0 and 90 deg, aspect is
+    the downhill direction clockwise from north between 0 and 360 deg.
+
+    args:
+        elevation (np.ndarray): array shaped (y, x) in the same units as pixel_size
+        pixel_size (float): pixel width and height
+        out (np.ndarray): Optional, preallocated float32 output shaped (4, y, x)
+    returns:
+        np.ndarray: float32 array shaped (4, y, x), bands in the order of TOPOGRAPHY_BANDS
+    """
+    ny,nx = elevation.shape
+    if out is None:
+        out = np.empty((len(TOPOGRAPHY_BANDS),ny,nx),dtype=np.float32)
+    elif out.shape != (len(TOPOGRAPHY_BANDS),ny,nx):
+        raise ValueError(f"out must be shaped {(len(TOPOGRAPHY_BANDS),ny,nx)}, got: {out.shape}")
+
+    z = np.pad(np.asarray(elevation,dtype=np.float32),1,mode='edge')
+    dzdx = (z[1:-1,2:] - z[1:-1,:-2]) / (2*pixel_size)
+    dzdy = (z[:-2,1:-1] - z[2:,1:-1]) / (2*pixel_size) # northward gradient
+
+    np.degrees(np.arctan(np.hypot(dzdx,dzdy)),out=out[0])
+    aspect = np.arctan2(-dzdx,-dzdy)
+    np.mod(np.degrees(aspect),360,out=out[1])
+    np.sin(aspect,out=out[2])
+    np.cos(aspect,out=out[3])
+    return out
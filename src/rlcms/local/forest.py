@@ -0,0 +1,206 @@
+import re
+import numpy as np
+
+# one node of an ee.Classifier.smileRandomForest tree description (explain()['trees']), e.g.
+#   "  2) B8<=0.2334 140 31.2 0 (0.78 0.22) *"
+# node id, split (root or feature<=threshold / feature>threshold), n, loss, yval, optional (yprob), * if terminal
+_NODE = re.compile(r'^\s*(\d+)\)\s+(\S+)\s+\S+\s+\S+\s+(\S+)(?:\s+\(([^)]*)\))?\s*(\*)?\s*$')
+_SPLIT = re.compile(r'^(.+?)(<=|>)(.+)$')
+
+def parse_tree(text:str,features:list):
+    """
+    Parse a text tree description into flat node arrays
+
+    Children of node i are nodes 2i and 2i+1, the `<=` split being the left branch. Leaf values are the
+    node's class probabilities (yprob) if printed, its yval otherwise.
+
+    args:
+        text (str): one tree description, e.g. an entry of ee.Classifier.explain()['trees']
+        features (list[str]): feature names, split features are indexed into this list
+    returns:
+        dict: 'feature' (int, -1 at leaves), 'threshold', 'left', 'right' (node indices, -1 at leaves)
+            and 'value' shaped (nodes, outputs), root at index 0
+    """
+    nodes = {}
+    for line in text.splitlines():
+        match = _NODE.match(line)
+        if match is None:
+            continue
+        node_id,split,yval,yprob,terminal = match.groups()
+        value = [float(v) for v in yprob.split()] if yprob else [float(yval)]
+        nodes[int(node_id)] = {'split':split,'value':value,'leaf':terminal is not None}
+    if 1 not in nodes:
+        raise ValueError(f"Could not find a root node in tree description: {text[:200]!r}")
+
+    ids = sorted(nodes)
+    index = {node_id:i for i,node_id in enumerate(ids)}
+    n_outputs = max(len(n['value']) for n in nodes.values())
+    tree = {'feature':np.full(len(ids),-1,dtype=np.int32),
+            'threshold':np.zeros(len(ids),dtype=np.float64),
+            'left':np.full(len(ids),-1,dtype=np.int32),
+            'right':np.full(len(ids),-1,dtype=np.int32),
+            'value':np.zeros((len(ids),n_outputs),dtype=np.float64)}
+    feature_index = {f:i for i,f in enumerate(features)}
+
+    for node_id,i in index.items():
+        node = nodes[node_id]
+        tree['value'][i,:len(node['value'])] = node['value']
+        children = [c for c in (2*node_id,2*node_id+1) if c in nodes]
+        if node['leaf'] or len(children) == 0:
+            continue
+        if len(children) != 2:
+            raise ValueError(f"node {node_id} has a single child in tree description")
+        le,gt = children
+        feature,op,threshold = _SPLIT.match(nodes[le]['split']).groups()
+        if op == '>':
+            le,gt = gt,le
+        if feature not in feature_index:
+            raise ValueError(f"tree splits on {feature!r}, which is not one of the features: {features}")
+        tree['feature'][i] = feature_index[feature]
+        tree['threshold'][i] = float(threshold)
+        tree['left'][i] = index[le]
+        tree['right'][i] = index[gt]
+    return tree
+
+class CompiledForest:
+    """
+    A tree ensemble compiled into flat node arrays for vectorized inference
+
+    All trees are concatenated into one node table. Prediction walks every tree for every pixel at
+    once, one tree level per step, and averages the leaf values over trees, so for a probability
+    random forest the output is the mean of the leaves' class probabilities.
+
+    args:
+        trees (list[dict]): node arrays as returned by parse_tree()
+        features (list[str]): feature (band) names the trees split on, in input order
+    """
+    def __init__(self,trees:list,features:list):
+        if len(trees) == 0:
+            raise ValueError("trees must contain at least one tree")
+        self.features = list(features)
+        self.n_outputs = max(t['value'].shape[1] for t in trees)
+        offsets = np.cumsum([0]+[len(t['feature']) for t in trees])
+        self.roots = offsets[:-1].astype(np.int32)
+        self.feature = np.concatenate([t['feature'] for t in trees])
+        self.threshold = np.concatenate([t['threshold'] for t in trees]).astype(np.float32)
+        # leaves point to themselves, so finished trees stay put while deeper ones descend
+        own = np.arange(offsets[-1],dtype=np.int32)
+        self.left = np.concatenate([np.where(t['left'] < 0,-1,t['left']+o) for t,o in zip(trees,offsets)])
+        self.right = np.concatenate([np.where(t['right'] < 0,-1,t['right']+o) for t,o in zip(trees,offsets)])
+        self.left = np.where(self.feature < 0,own,self.left).astype(np.int32)
+        self.right = np.where(self.feature < 0,own,self.right).astype(np.int32)
+        self.value = np.zeros((offsets[-1],self.n_outputs),dtype=np.float32)
+        for t,o in zip(trees,offsets):
+            self.value[o:o+len(t['feature']),:t['value'].shape[1]] = t['value']
+        self.depth = max(_depth(t) for t in trees)
+
+    @classmethod
+    def from_trees(cls,trees:list,features:list,output:int=None):
+        """
+        compile text tree descriptions (ee.Classifier.explain()['trees']) over the given feature names
+
+        args:
+            trees (list[str]): tree descriptions
+            features (list[str]): feature names the trees split on
+            output (int): Optional, only keep this leaf value column, e.g. 1 for the class 1 probability (yprob) 
+                of a binary probability forest. Default = every leaf value column
+        """
+        parsed = [parse_tree(t,features) for t in trees]
+        if output is not None:
+            parsed = [dict(t,value=t['value'][:,[output]]) for t in parsed]
+        return cls(parsed,features)
+
+    @classmethod
+    def from_sklearn(cls,model,features:list,class_value=None):
+        """
+        compile a fitted scikit-learn tree ensemble (e.g. RandomForestClassifier), `features` naming its input columns
+
+        args:
+            model: fitted sklearn forest with an `estimators_` list of decision trees
+            features (list[str]): feature names in the order the model was fitted on
+            class_value: Optional, only output the probability of this class (one of model.classes_). 
+                Default = one output per class (or the regression value)
+        """
+        trees = []
+        for estimator in model.estimators_:
+            t = estimator.tree_
+            value = t.value[:,0,:].astype(np.float64)
+            if hasattr(model,'classes_'):
+                # class counts (or fractions) -> probabilities, as RandomForestClassifier.predict_proba averages them
+                value = value/np.maximum(value.sum(axis=1,keepdims=True),np.finfo(np.float64).tiny)
+                if class_value is not None:
+                    value = value[:,[list(model.classes_).index(class_value)]]
+            leaf = t.children_left < 0
+            trees.append({'feature':np.where(leaf,-1,t.feature).astype(np.int32),
+                          'threshold':np.where(leaf,0,t.threshold),
+                          'left':t.children_left.astype(np.int32),
+                          'right':t.children_right.astype(np.int32),
+                          'value':value})
+        return cls(trees,features)
+
+    def predict(self,values,batch_size:int=8192):
+        """
+        args:
+            values (np.ndarray): features shaped (len(features), pixels)
+            batch_size (int): pixels walked through all trees at once, bounds the (trees, pixels) node index array. Default = 8192
+        returns:
+            np.ndarray: float32 mean leaf values shaped (n_outputs, pixels), NaN where any feature is NaN
+        """
+        values = np.asarray(values,dtype=np.float32)
+        if values.ndim != 2 or values.shape[0] != len(self.features):
+            raise ValueError(f"values must be shaped ({len(self.features)}, pixels), got: {values.shape}")
+        n_pixels = values.shape[1]
+        out = np.empty((self.n_outputs,n_pixels),dtype=np.float32)
+        # leaf features are -1, they read a valid row and are then ignored since leaves point to themselves
+        feature = np.maximum(self.feature,0)
+        for p0 in range(0,n_pixels,batch_size):
+            p1 = min(p0+batch_size,n_pixels)
+            batch = values[:,p0:p1]
+            node = np.repeat(self.roots[:,None],p1-p0,axis=1)
+            pixel = np.arange(p1-p0)[None,:]
+            for _ in range(self.depth):
+                x = batch[feature[node],pixel]
+                node = np.where(x <= self.threshold[node],self.left[node],self.right[node])
+            out[:,p0:p1] = self.value[node].mean(axis=0).T
+        out[:,np.isnan(values).any(axis=0)] = np.nan
+        return out
+
+    def predict_stack(self,stack,bands:list=None,out=None,chunk_size:int=64):
+        """
+        Predict every pixel of a local (band, y, x) stack in chunks of rows
+
+        args:
+            stack (np.ndarray|np.memmap): array shaped (band, y, x)
+            bands (list[str]): Optional, band names of the first axis of `stack`. Default = the forest's features
+            out (np.ndarray|np.memmap): Optional, preallocated float32 output shaped (n_outputs, y, x)
+            chunk_size (int): number of rows predicted per block. Default = 64
+        returns:
+            np.ndarray|np.memmap: (n_outputs, y, x) float32 array
+        """
+        bands = self.features if bands is None else list(bands)
+        missing = [f for f in self.features if f not in bands]
+        if len(missing) > 0:
+            raise ValueError(f"stack is missing bands used by the forest: {missing}")
+        if stack.ndim != 3 or stack.shape[0] != len(bands):
+            raise ValueError(f"stack must be shaped (band, y, x) with {len(bands)} bands, got: {stack.shape}")
+        _,ny,nx = stack.shape
+        if out is None:
+            out = np.empty((self.n_outputs,ny,nx),dtype=np.float32)
+        elif out.shape != (self.n_outputs,ny,nx):
+            raise ValueError(f"out must be shaped {(self.n_outputs,ny,nx)}, got: {out.shape}")
+
+        rows = [bands.index(f) for f in self.features]
+        for r0 in range(0,ny,chunk_size):
+            r1 = min(r0+chunk_size,ny)
+            values = np.asarray(stack[rows,r0:r1,:],dtype=np.float32).reshape(len(rows),-1)
+            out[:,r0:r1,:] = self.predict(values).reshape(self.n_outputs,r1-r0,nx)
+        return out
+
+def _depth(tree:dict):
+    """number of splits on the longest root to leaf path"""
+    depth,level = 0,[0]
+    while True:
+        level = [c for i in level if tree['feature'][i] >= 0 for c in (tree['left'][i],tree['right'][i])]
+        if len(level) == 0:
+            return depth
+        depth += 1
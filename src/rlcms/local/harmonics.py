@@ -0,0 +1,278 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from rlcms.temporal import _to_day
+
+# regressors of rlcms.harmonics.calculateHarmonic, in design matrix column order
+HARMONIC_INDEPENDENTS = ['constant','t','cos','sin']
+
+def time_constant(dates):
+    """
+    Fractional years since 1970-01-01 for each date, the `t` band of rlcms.harmonics.addTimeConstant
+    (the fraction is the elapsed share of the date's calendar year)
+    """
+    days = _to_day(dates)
+    years = days.astype('datetime64[Y]')
+    year_start = years.astype('datetime64[D]')
+    year_length = ((years + 1).astype('datetime64[D]') - year_start).astype(np.float64)
+    return (years.astype(np.int64) + (days - year_start).astype(np.float64)/year_length).astype(np.float64)
+
+def harmonic_independents(order:int=1):
+    """regressor names of a harmonic model of `order`, [constant, t, cos, sin, cos2, sin2, ...]"""
+    if order < 1:
+        raise ValueError(f"order must be 1 or more, got: {order}")
+    names = list(HARMONIC_INDEPENDENTS)
+    for k in range(2,order+1):
+        names += [f"cos{k}",f"sin{k}"]
+    return names
+
+def design_matrix(dates,order:int=1,epoch_year:int=1970):
+    """
+    (n, 2 + 2*order) float64 design matrix [constant, t, cos(2 pi t), sin(2 pi t), cos(4 pi t), ...] of the scene dates,
+    t in fractional years since Jan 1st of epoch_year. An integer-year epoch leaves the cos and sin terms unchanged
+    """
+    t = time_constant(dates) - (epoch_year - 1970)
+    columns = [np.ones_like(t),t]
+    for k in range(1,order+1):
+        radians = 2*np.pi*k*t
+        columns += [np.cos(radians),np.sin(radians)]
+    return np.stack(columns,axis=1)
+
+def day_of_year_mask(dates,start:int,end:int):
+    """
+    boolean mask of dates whose day of year is within [start, end], wrapping around the new year
+    if start > end like ee.Filter.dayOfYear()
+    """
+    days = _to_day(dates)
+    doy = (days - days.astype('datetime64[Y]').astype('datetime64[D]')).astype(np.int64) + 1
+    if start <= end:
+        return (doy >= start) & (doy <= end)
+    return (doy >= start) | (doy <= end)
+
+def solve_least_squares(X,values):
+    """
+    Least-squares coefficients of every pixel's series against one shared design matrix
+
+    Pixels valid in every scene share a single pseudo-inverse applied with one matmul. Pixels with
+    missing values solve their own 4x4 normal equations, built for all of them at once from the
+    validity mask, in one batched solve. Pixels with fewer valid scenes than regressors get NaN.
+
+    args:
+        X (np.ndarray): design matrix shaped (n, k)
+        values (np.ndarray): series shaped (n, pixels), NaN where masked
+    returns:
+        np.ndarray: float64 coefficients shaped (k, pixels)
+    """
+    n,k = X.shape
+    values = np.asarray(values,dtype=np.float64)
+    coefficients = np.full((k,values.shape[1]),np.nan)
+    if n == 0:
+        return coefficients
+
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=0)
+    full = counts == n
+    if full.any() and n >= k:
+        coefficients[:,full] = np.linalg.pinv(X) @ values[:,full]
+
+    partial = ~full & (counts >= k)
+    if partial.any():
+        mask = valid[:,partial].astype(np.float64)
+        y = np.where(valid[:,partial],values[:,partial],0)
+        XtX = np.einsum('tp,ti,tj->pij',mask,X,X)
+        Xty = np.einsum('ti,tp->pi',X,y)
+        try:
+            solved = np.linalg.solve(XtX,Xty[...,None])[...,0]
+        except np.linalg.LinAlgError:
+            # some pixels' valid scenes do not determine the fit, solve those in the least-squares sense
+            solved = (np.linalg.pinv(XtX) @ Xty[...,None])[...,0]
+        coefficients[:,partial] = solved.T
+    return coefficients
+
+def harmonic_coefficients(series,dates,scenes=None,chunk_size:int=256,max_workers:int=None):
+    """
+    Fit constant, t, cos and sin coefficients (rlcms.harmonics.calculateHarmonic) for every pixel of a series
+
+    args:
+        series (np.ndarray|np.memmap): one band's series shaped (time, y, x), NaN where masked
+        dates (list[str]|np.ndarray): acquisition date of each scene along the time axis
+        scenes (np.ndarray): Optional, indices of the scenes to fit, read block by block. Default = all scenes
+        chunk_size (int): number of rows fitted per task. Default = 256
+        max_workers (int): number of threads. Default = ThreadPoolExecutor default
+    returns:
+        np.ndarray: float32 array shaped (4, y, x), coefficients in HARMONIC_INDEPENDENTS order
+    """
+    if series.ndim != 3 or series.shape[0] != len(dates):
+        raise ValueError(f"series must be shaped (time, y, x) with {len(dates)} scenes, got: {series.shape}")
+    if scenes is None:
+        scenes = np.arange(len(dates))
+    X = design_matrix(np.asarray(dates)[scenes])
+    _,ny,nx = series.shape
+    out = np.empty((X.shape[1],ny,nx),dtype=np.float32)
+
+    def fit_block(r0,r1):
+        values = np.asarray(series[:,r0:r1,:][scenes],dtype=np.float64).reshape(len(scenes),-1)
+        out[:,r0:r1,:] = solve_least_squares(X,values).reshape(-1,r1-r0,nx)
+
+    windows = [(r0,min(r0+chunk_size,ny)) for r0 in range(0,ny,chunk_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for f in [executor.submit(fit_block,r0,r1) for r0,r1 in windows]:
+            f.result()
+    return out
+
+def phase_amplitude(coefficients):
+    """(4, ...) coefficients -> (2, ...) phase (atan2(cos, sin)) and amplitude (hypot(cos, sin))"""
+    cos,sin = coefficients[2],coefficients[3]
+    return np.stack([np.arctan2(cos,sin),np.hypot(cos,sin)]).astype(np.float32)
+
+def harmonic_bands(harmonicsOptions:dict):
+    """output band names of harmonics_from_options, in the sorted band order of rlcms.harmonics.doHarmonicsFromOptions"""
+    return [f"{b}_{suffix}" for b in sorted(harmonicsOptions) for suffix in ('phase','amplitude')]
+
+def harmonics_from_options(cube,
+                           dates,
+                           bands:list,
+                           harmonicsOptions:dict,
+                           out=None,
+                           chunk_size:int=256,
+                           max_workers:int=None):
+    """
+    Local counterpart of rlcms.harmonics.doHarmonicsFromOptions on a time-stacked scene cube
+
+    args:
+        cube (np.ndarray|np.memmap): array shaped (time, band, y, x), NaN where masked
+        dates (list[str]|np.ndarray): acquisition date of each scene along the time axis
+        bands (list[str]): band names of the band axis
+        harmonicsOptions (dict): band -> day of year window, e.g. {'nir':{'start':1,'end':365}}
+        out (np.ndarray|np.memmap): Optional, preallocated float32 output shaped (2*len(harmonicsOptions), y, x)
+        chunk_size (int): number of rows fitted per task. Default = 256
+        max_workers (int): number of threads. Default = ThreadPoolExecutor default
+    returns:
+        tuple(np.ndarray|np.memmap, list[str]): {band}_phase and {band}_amplitude bands shaped (band, y, x) and their names
+    """
+    if cube.ndim != 4 or cube.shape[1] != len(bands):
+        raise ValueError(f"cube must be shaped (time, band, y, x) with {len(bands)} bands, got: {cube.shape}")
+    missing = [b for b in harmonicsOptions if b not in bands]
+    if len(missing) > 0:
+        raise ValueError(f"harmonicsOptions bands not in the cube: {missing}")
+    dates = np.asarray(dates)
+    names = harmonic_bands(harmonicsOptions)
+    _,_,ny,nx = cube.shape
+    if out is None:
+        out = np.empty((len(names),ny,nx),dtype=np.float32)
+    elif out.shape != (len(names),ny,nx):
+        raise ValueError(f"out must be shaped {(len(names),ny,nx)}, got: {out.shape}")
+
+    for i,band in enumerate(sorted(harmonicsOptions)):
+        window = harmonicsOptions[band]
+        scenes = np.flatnonzero(day_of_year_mask(dates,window['start'],window['end']))
+        coefficients = harmonic_coefficients(cube[:,bands.index(band)],dates,scenes=scenes,
+                                             chunk_size=chunk_size,max_workers=max_workers)
+        out[2*i:2*i+2] = phase_amplitude(coefficients)
+    return out,names
+
+class HarmonicAccumulator:
+    """
+    Per-pixel normal-equation statistics of a harmonic model, updated incrementally as new scenes arrive
+
+    Stores the upper triangle of XᵀX, Xᵀy and the valid scene count n of every pixel as float32, so
+    folding in new scenes costs O(new scenes) and refitting is one batched solve of small systems.
+    t is measured from Jan 1st of an integer `epoch_year` (keep it close to the data to preserve float32
+    precision), which changes the constant and t coefficients but not the phase and amplitude.
+
+    args:
+        shape (tuple(int,int)): (y, x) shape of the series
+        order (int): number of harmonics (cos/sin pairs). Default = 1, the model of rlcms.harmonics.calculateHarmonic
+        epoch_year (int): year t is measured from. Default = 2000
+    """
+    def __init__(self,shape:tuple,order:int=1,epoch_year:int=2000):
+        self.shape = tuple(shape)
+        self.order = int(order)
+        self.epoch_year = int(epoch_year)
+        self.independents = harmonic_independents(self.order)
+        k = len(self.independents)
+        self._upper = np.triu_indices(k)
+        self.xtx = np.zeros((len(self._upper[0]),)+self.shape,dtype=np.float32)
+        self.xty = np.zeros((k,)+self.shape,dtype=np.float32)
+        self.n = np.zeros(self.shape,dtype=np.float32)
+
+    def update(self,series,dates,chunk_size:int=256):
+        """
+        fold scenes into the statistics
+        args:
+            series (np.ndarray|np.memmap): new scenes of one band shaped (time, y, x), NaN where masked
+            dates (list[str]|np.ndarray): acquisition date of each scene
+            chunk_size (int): number of rows folded in at a time. Default = 256
+        """
+        if series.ndim != 3 or series.shape[1:] != self.shape or series.shape[0] != len(dates):
+            raise ValueError(f"series must be shaped (time, {self.shape[0]}, {self.shape[1]}) "
+                             f"with {len(dates)} scenes, got: {series.shape}")
+        X = design_matrix(dates,self.order,self.epoch_year)
+        # outer products of the design rows, only the upper triangle is stored
+        outer = (X[:,:,None]*X[:,None,:])[:,self._upper[0],self._upper[1]]
+        ny,nx = self.shape
+        for r0 in range(0,ny,chunk_size):
+            r1 = min(r0+chunk_size,ny)
+            values = np.asarray(series[:,r0:r1,:],dtype=np.float64).reshape(len(dates),-1)
+            valid = ~np.isnan(values)
+            y = np.where(valid,values,0)
+            self.xtx[:,r0:r1,:] += (outer.T @ valid).reshape(-1,r1-r0,nx)
+            self.xty[:,r0:r1,:] += (X.T @ y).reshape(-1,r1-r0,nx)
+            self.n[r0:r1,:] += valid.sum(axis=0).reshape(r1-r0,nx)
+        return self
+
+    def coefficients(self,chunk_size:int=256):
+        """
+        solve the normal equations of every pixel
+        returns:
+            np.ndarray: float32 coefficients shaped (len(independents), y, x), NaN where fewer valid scenes than regressors
+        """
+        k = len(self.independents)
+        ny,nx = self.shape
+        out = np.full((k,ny,nx),np.nan,dtype=np.float32)
+        for r0 in range(0,ny,chunk_size):
+            r1 = min(r0+chunk_size,ny)
+            enough = (self.n[r0:r1,:] >= k).reshape(-1)
+            if not enough.any():
+                continue
+            packed = self.xtx[:,r0:r1,:].reshape(len(self._upper[0]),-1)[:,enough].astype(np.float64)
+            XtX = np.zeros((packed.shape[1],k,k))
+            XtX[:,self._upper[0],self._upper[1]] = packed.T
+            XtX[:,self._upper[1],self._upper[0]] = packed.T
+            Xty = self.xty[:,r0:r1,:].reshape(k,-1)[:,enough].T.astype(np.float64)
+            try:
+                solved = np.linalg.solve(XtX,Xty[...,None])[...,0]
+            except np.linalg.LinAlgError:
+                solved = (np.linalg.pinv(XtX) @ Xty[...,None])[...,0]
+            block = out[:,r0:r1,:].reshape(k,-1)
+            block[:,enough] = solved.T
+            out[:,r0:r1,:] = block.reshape(k,r1-r0,nx)
+        return out
+
+    def harmonics(self,band:str,chunk_size:int=256):
+        """
+        phase and amplitude of every harmonic
+        returns:
+            tuple(np.ndarray, list[str]): float32 bands shaped (2*order, y, x) and their names, {band}_phase and
+                {band}_amplitude for the first harmonic (as rlcms.harmonics), {band}_phase{k} and {band}_amplitude{k} for the others
+        """
+        coefficients = self.coefficients(chunk_size)
+        bands,names = [],[]
+        for k in range(1,self.order+1):
+            suffix = '' if k == 1 else str(k)
+            bands.append(phase_amplitude(coefficients[[0,1,2*k,2*k+1]]))
+            names += [f"{band}_phase{suffix}",f"{band}_amplitude{suffix}"]
+        return np.concatenate(bands),names
+
+    def save(self,path:str):
+        """write the statistics to a .npz file"""
+        np.savez(path,xtx=self.xtx,xty=self.xty,n=self.n,order=self.order,epoch_year=self.epoch_year)
+
+    @classmethod
+    def load(cls,path:str):
+        """read statistics written by save()"""
+        with np.load(path) as data:
+            accumulator = cls(data['n'].shape,order=int(data['order']),epoch_year=int(data['epoch_year']))
+            accumulator.xtx[...] = data['xtx']
+            accumulator.xty[...] = data['xty']
+            accumulator.n[...] = data['n']
+        return accumulator
@@ -0,0 +1,130 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from rlcms.local.covariates import (INDICES, compute_indices, tasseled_cap, tasseled_cap_bands,
+                                    topography, TOPOGRAPHY_BANDS)
+from rlcms.formulas import compile_formulas
+
+def plan_covariates(bands:list,**kwargs):
+    """
+    Output band schema of covariates_from_options() for an input stack
+    args:
+        bands (list[str]): band names of the input stack
+        kwargs (dict): a settings dictionary, same keys as rlcms.covariates.returnCovariatesFromOptions()
+            plus 'addTopography'
+    returns:
+        dict: 'indices', 'formulas', 'tasselcap', 'topography' band lists and 'bands', the full output band list
+    """
+    formulas = kwargs.get('formulas') or {}
+    planned = []
+    for i in kwargs.get('indices',[]):
+        if i not in bands and i not in planned:
+            if i not in INDICES and i not in formulas:
+                raise ValueError(f"Unknown index: {i}")
+            planned.append(i)
+    plan = {'indices':[i for i in planned if i not in formulas],
+            'formulas':[i for i in planned if i in formulas],
+            'tasselcap':[],
+            'topography':[]}
+
+    if kwargs.get('addTasselCap',False):
+        plan['tasselcap'] = [b for b in tasseled_cap_bands(kwargs.get('tasselCapSensor')) if b not in bands]
+    if kwargs.get('addTopography',False):
+        if 'elevation' not in bands:
+            raise ValueError("addTopography requires an 'elevation' band in the input stack")
+        plan['topography'] = [b for b in TOPOGRAPHY_BANDS if b not in bands]
+
+    plan['bands'] = (list(bands) + plan['indices'] + plan['formulas']
+                     + plan['tasselcap'] + plan['topography'])
+    return plan
+
+def _process_block(src,dst,bands,r0,r1,pixel_size,settings):
+    """compute covariates for rows r0:r1 of the memory-mapped src stack into the memory-mapped dst stack"""
+    stack = np.load(src,mmap_mode='r')
+    out = np.load(dst,mmap_mode='r+')
+    plan = plan_covariates(bands,**settings)
+    block = np.asarray(stack[:,r0:r1,:],dtype=np.float32)
+
+    i = len(bands)
+    out[:i,r0:r1,:] = block
+    if len(plan['indices']) > 0:
+        n = len(plan['indices'])
+        compute_indices(block,plan['indices'],bands=bands,out=out[i:i+n,r0:r1,:])
+        i += n
+    if len(plan['formulas']) > 0:
+        n = len(plan['formulas'])
+        compiled = compile_formulas({f:settings['formulas'][f] for f in plan['formulas']})
+        compiled.evaluate(block,bands,out=out[i:i+n,r0:r1,:])
+        i += n
+    if len(plan['tasselcap']) > 0:
+        sensor = settings.get('tasselCapSensor')
+        names = tasseled_cap_bands(sensor)
+        if plan['tasselcap'] == names:
+            tasseled_cap(block,sensor,bands=bands,out=out[i:i+len(names),r0:r1,:])
+            i += len(names)
+        else:
+            tc = tasseled_cap(block,sensor,bands=bands)
+            for b in plan['tasselcap']:
+                out[i,r0:r1,:] = tc[names.index(b)]
+                i += 1
+    if len(plan['topography']) > 0:
+        # read one row of halo on each side so gradients at block edges match a whole-raster computation
+        h0,h1 = max(r0-1,0),min(r1+1,stack.shape[1])
+        elevation = stack[bands.index('elevation'),h0:h1,:]
+        topo = topography(elevation,pixel_size)[:,r0-h0:r0-h0+(r1-r0),:]
+        for b in plan['topography']:
+            out[i,r0:r1,:] = topo[TOPOGRAPHY_BANDS.index(b)]
+            i += 1
+    out.flush()
+    del out,stack
+    return r0,r1
+
+def covariates_from_options(src:str,
+                            dst:str,
+                            bands:list,
+                            block_size:int=512,
+                            max_workers:int=None,
+                            pixel_size:float=30,
+                            **kwargs):
+    """
+    Streaming, process-parallel local counterpart of rlcms.covariates.returnCovariatesFromOptions()
+
+    Reads windowed blocks of rows from a memory-mapped input stack, computes the settings-driven covariates
+    (indices, formulas, tasseled cap, topography) for each block in a process pool and writes them into a
+    memory-mapped output stack. Each worker only holds one block in memory, so peak memory is bounded by
+    block_size and max_workers regardless of raster size.
+    Static layers (e.g. JRC water) have no local source and must already be bands of the input stack.
+
+    args:
+        src (str): path to a .npy (band, y, x) input stack, opened memory-mapped
+        dst (str): path of the .npy (band, y, x) float32 output stack to create
+        bands (list[str]): band names of the first axis of the input stack
+        block_size (int): number of rows per block. Default = 512
+        max_workers (int): number of worker processes. Default = os.cpu_count()
+        pixel_size (float): pixel size in elevation units, used for topography. Default = 30
+    kwargs:
+        indices:list[str]
+        formulas:dict
+        addTasselCap:bool
+        tasselCapSensor:str
+        addTopography:bool requires an 'elevation' band
+    returns:
+        list[str]: band names of the output stack
+    """
+    stack = np.load(src,mmap_mode='r')
+    if stack.ndim != 3 or stack.shape[0] != len(bands):
+        raise ValueError(f"{src} must be shaped (band, y, x) with {len(bands)} bands, got: {stack.shape}")
+    _,ny,nx = stack.shape
+    del stack
+
+    plan = plan_covariates(bands,**kwargs)
+    out = np.lib.format.open_memmap(dst,mode='w+',dtype=np.float32,shape=(len(plan['bands']),ny,nx))
+    del out
+
+    windows = [(r0,min(r0+block_size,ny)) for r0 in range(0,ny,block_size)]
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        futures = [executor.submit(_process_block,src,dst,list(bands),r0,r1,pixel_size,kwargs)
+                   for r0,r1 in windows]
+        for f in futures:
+            f.result()
+    return plan['bands']
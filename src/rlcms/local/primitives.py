@@ -0,0 +1,230 @@
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from rlcms.local.forest import CompiledForest
+
+try:
+    from sklearn.ensemble import RandomForestClassifier
+except ImportError:
+    RandomForestClassifier = None
+
+# properties of strat_sample_from_reference() / exported sample tables that are not features
+NON_FEATURES = ['system:index','.geo','random']
+
+# rlcms.primitives.Primitives RFprim classifier parameters (smileRandomForest defaults otherwise)
+RF_PARAMS = {'n_estimators':100,
+             'min_samples_leaf':1,
+             'max_samples':0.7,
+             'max_features':'sqrt',
+             'random_state':51515}
+
+def sample_features(table:pd.DataFrame,class_name:str='LANDCOVER'):
+    """feature columns of a sample table: every numeric column except the class label and NON_FEATURES"""
+    return [c for c in table.columns
+            if c != class_name and c not in NON_FEATURES and pd.api.types.is_numeric_dtype(table[c])]
+
+def _forest(seed:int=None,**params):
+    if RandomForestClassifier is None:
+        raise ImportError("local primitive training requires scikit-learn, install it with: pip install rlcms[local]")
+    params = dict(RF_PARAMS,**params)
+    if seed is not None:
+        params['random_state'] = seed
+    return RandomForestClassifier(bootstrap=True,oob_score=True,n_jobs=1,**params)
+
+def top_features(importance:dict,n:int=20):
+    """the n most important features (all of them if there are fewer), most important first"""
+    return sorted(importance,key=importance.get,reverse=True)[:n]
+
+def screen_features(X,labels,features:list,n:int=20,fraction:float=None,seed:int=None,**params):
+    """
+    Rank features once for all primitives with a single multiclass random forest
+
+    args:
+        X (np.ndarray): feature values shaped (samples, len(features))
+        labels (np.ndarray): class label of each sample
+        features (list[str]): feature names
+        n (int): number of most important features returned. Default = 20
+        fraction (float): Optional, train on this fraction of each class's samples (a stratified subsample)
+        seed (int): Optional, random seed. Default = RF_PARAMS['random_state']
+        **params: RandomForestClassifier parameters overriding RF_PARAMS
+    returns:
+        list[str]: the n most important features, most important first
+    """
+    labels = np.asarray(labels)
+    if fraction is not None:
+        rng = np.random.default_rng(RF_PARAMS['random_state'] if seed is None else seed)
+        keep = np.concatenate([rng.permutation(np.flatnonzero(labels == c))[:max(1,int(round(fraction*np.sum(labels == c))))]
+                               for c in np.unique(labels)])
+        X,labels = X[np.sort(keep)],labels[np.sort(keep)]
+    model = _forest(seed,**params).fit(X,labels)
+    return top_features(dict(zip(features,model.feature_importances_.tolist())),n)
+
+def train_primitive(X,labels,features:list,class_value,top:int=20,seed:int=None,screened:list=None,refine:bool=False,**params):
+    """
+    Train one binary primitive the way Primitives.RFprim does: a probability random forest on all features,
+    then a second one on the `top` most important features
+
+    args:
+        X (np.ndarray): feature values shaped (samples, len(features))
+        labels (np.ndarray): class label of each sample
+        features (list[str]): feature names
+        class_value (int): class label of the primitive, samples of this class are 1, all others 0
+        top (int): number of most important features kept for the second model. Default = 20
+        seed (int): Optional, random seed. Default = RF_PARAMS['random_state']
+        screened (list[str]): Optional, features ranked by screen_features(). The primitive is then trained once
+            on its first `top`, or ranks its own top features among all of them if refine
+        refine (bool): rank features per primitive among `screened`. Default = False
+        **params: RandomForestClassifier parameters overriding RF_PARAMS
+    returns:
+        dict: 'Primitive', 'importance' and 'oobError' of the final model (the Primitive image properties),
+            its 'features', the fitted 'model', the model class holding the primitive's probability ('class_value')
+            and the number of forests trained ('fits')
+    """
+    y = (np.asarray(labels) == class_value).astype(np.int32)
+    fits = 1
+    if screened is None or refine:
+        candidates = features if screened is None else list(screened)
+        columns = [features.index(f) for f in candidates]
+        model = _forest(seed,**params).fit(X[:,columns],y)
+        selected = top_features(dict(zip(candidates,model.feature_importances_.tolist())),top)
+        fits += 1
+    else:
+        selected = list(screened)[:top]
+
+    columns = [features.index(f) for f in selected]
+    model = _forest(seed,**params).fit(X[:,columns],y)
+    return {'Primitive':class_value,
+            'importance':dict(zip(selected,model.feature_importances_.tolist())),
+            'oobError':1.0 - model.oob_score_,
+            'features':selected,
+            'model':model,
+            'class_value':1,
+            'fits':fits}
+
+def train_multiclass(X,labels,features:list,top:int=20,seed:int=None,**params):
+    """
+    Train one multiclass probability random forest on all features, then on its `top` most important ones,
+    the local counterpart of Primitives model_mode='multiclass'
+
+    args:
+        X (np.ndarray): feature values shaped (samples, len(features))
+        labels (np.ndarray): class label of each sample
+        features (list[str]): feature names
+        top (int): number of most important features kept for the second model. Default = 20
+        seed (int): Optional, random seed. Default = RF_PARAMS['random_state']
+        **params: RandomForestClassifier parameters overriding RF_PARAMS
+    returns:
+        list[dict]: one train_primitive()-like result per class in sorted label order, all sharing the model
+    """
+    model = _forest(seed,**params).fit(X,labels)
+    selected = top_features(dict(zip(features,model.feature_importances_.tolist())),top)
+    columns = [features.index(f) for f in selected]
+    model = _forest(seed,**params).fit(X[:,columns],labels)
+    importance = dict(zip(selected,model.feature_importances_.tolist()))
+    return [{'Primitive':c,
+             'importance':importance,
+             'oobError':1.0 - model.oob_score_,
+             'features':selected,
+             'model':model,
+             'class_value':c,
+             'fits':2 if i == 0 else 0}
+            for i,c in enumerate(model.classes_.tolist())]
+
+def primitive_probability(primitive:dict,X):
+    """
+    probability of a primitive for samples of its features
+    args:
+        primitive (dict): train_primitive() or train_multiclass() result
+        X (np.ndarray): values of primitive['features'] shaped (samples, len(features))
+    returns:
+        np.ndarray: probability of each sample
+    """
+    model = primitive['model']
+    return model.predict_proba(X)[:,list(model.classes_).index(primitive['class_value'])]
+
+def _train_task(args):
+    X,labels,features,class_value,top,seed,screened,refine,params = args
+    return train_primitive(X,labels,features,class_value,top=top,seed=seed,screened=screened,refine=refine,**params)
+
+def train_primitives(table:pd.DataFrame,
+                     class_name:str='LANDCOVER',
+                     features:list=None,
+                     top:int=20,
+                     max_workers:int=None,
+                     seed:int=None,
+                     importance_mode:str='per_class',
+                     refine:bool=False,
+                     screening_fraction:float=None,
+                     model_mode:str='binary',
+                     **params):
+    """
+    Train the one-vs-rest primitive models of every class of a local sample table in parallel
+
+    The local counterpart of rlcms.primitives.Primitives training, run on a table of extracted samples
+    (e.g. the bands-as-properties output of rlcms.sampling.strat_sample_from_reference exported to CSV).
+    Each class trains in its own process. Requires scikit-learn.
+
+    args:
+        table (pd.DataFrame): one row per sample with a class label column and one column per feature
+        class_name (str): class label column. Default = 'LANDCOVER'
+        features (list[str]): Optional, feature columns. Default = sample_features(table,class_name)
+        top (int): number of most important features kept for the second model. Default = 20
+        max_workers (int): number of processes. Default = ProcessPoolExecutor default
+        seed (int): Optional, random seed. Default = RF_PARAMS['random_state']
+        importance_mode (str): 'per_class' (default) or 'shared', see rlcms.primitives.Primitives
+        refine (bool): in 'shared' mode, rank features per primitive among the shared top 2*top. Default = False
+        screening_fraction (float): Optional, in 'shared' mode, train the screening model on this fraction of each class's samples
+        model_mode (str): 'binary' (default) or 'multiclass', see rlcms.primitives.Primitives
+        **params: RandomForestClassifier parameters overriding RF_PARAMS
+    returns:
+        list[dict]: train_primitive() results, one per class in sorted label order
+    """
+    if class_name not in table.columns:
+        raise ValueError(f"class_name {class_name!r} is not a column of the table")
+    if importance_mode not in ('per_class','shared'):
+        raise ValueError(f"importance_mode must be one of 'per_class' or 'shared', got: {importance_mode}")
+    if features is None:
+        features = sample_features(table,class_name)
+    table = table.dropna(subset=features+[class_name])
+    X = table[features].to_numpy(dtype=np.float32)
+    labels = table[class_name].round().astype(int).to_numpy()
+    classes = sorted(np.unique(labels).tolist())
+
+    if model_mode == 'multiclass':
+        return train_multiclass(X,labels,features,top=top,seed=seed,**params)
+    elif model_mode != 'binary':
+        raise ValueError(f"model_mode must be one of 'binary' or 'multiclass', got: {model_mode}")
+
+    screened = None
+    if importance_mode == 'shared':
+        screened = screen_features(X,labels,features,n=2*top if refine else top,
+                                   fraction=screening_fraction,seed=seed,**params)
+
+    tasks = [(X,labels,features,c,top,seed,screened,refine,params) for c in classes]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_train_task,tasks))
+
+def export_metrics(primitives:list,metrics_path:str):
+    """
+    Write each primitive's variable importance and OOB error to the files Primitives.export_metrics() writes
+
+    args:
+        primitives (list[dict]): train_primitives() results
+        metrics_path (str): local folder
+    """
+    for prim in primitives:
+        prim_value = str(prim['Primitive'])
+        importance = prim['importance']
+        df = pd.DataFrame(list(importance.values()),index=list(importance.keys()))
+        df.to_csv(os.path.join(metrics_path,f"varImportancePrimitive{prim_value}.csv"))
+        with open(os.path.join(metrics_path,f'oobErrorPrimitive{prim_value}.txt'),mode='w') as f:
+            f.write(str(prim['oobError']))
+
+def compile_primitives(primitives:list):
+    """
+    Compile trained primitives for local inference
+    returns:
+        dict: Primitive class value -> CompiledForest whose first output is the primitive's probability
+    """
+    return {p['Primitive']:CompiledForest.from_sklearn(p['model'],p['features'],class_value=p['class_value']) for p in primitives}
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import re
+from rlcms.temporal import period_ends, _to_day
+
+# band names of a multi-period composite start with the period's index, e.g. t3_blue_mean
+PERIOD_PREFIX = re.compile(r'^t(\d+)_')
+
+# ee batch task states of an export that will never produce its asset
+FAILED_STATES = ['FAILED','CANCELLED','CANCEL_REQUESTED']
+
+def settings_fingerprint(dataset:str,aoi:str,start_date:str,settings:dict):
+    """
+    sha256 fingerprint of everything that determines a composite's period bands, except its end date,
+    so runs that only extend the date range share the fingerprint
+    args:
+        dataset (str): dataset name or GEE ImageCollection asset path
+        aoi (str): asset path of the area of interest
+        start_date (str): start date (yyyy-mm-dd), the first period is t0
+        settings (dict): compositing settings (as passed to rlcms.composites.Composite), `periods` is ignored
+    returns:
+        str: hex digest
+    """
+    settings = {k:v for k,v in settings.items() if k != 'periods'}
+    payload = json.dumps({'dataset':dataset,'aoi':aoi,'start_date':start_date,'settings':settings},
+                         sort_keys=True,default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def complete_periods(periods:list,end_date:str,period:int,period_unit:str):
+    """
+    periods that end on or before the (exclusive) end_date, i.e. not cut short by it. Only these are recorded
+    as covered, since the fingerprint leaves out the end date and a later run extending the range must
+    recompute a partial last period
+    args:
+        periods (list[str]): period start dates
+        end_date (str): end date of the run (yyyy-mm-dd), exclusive
+        period (int): period length
+        period_unit (str): one of 'year' or 'month'
+    returns:
+        list[str]: the complete periods, in the order given
+    """
+    if len(periods) == 0:
+        return []
+    complete = period_ends(_to_day(periods),period,period_unit) <= _to_day(end_date)[0]
+    return [p for p,c in zip(periods,complete) if c]
+
+def period_bands(bands:list,index:int):
+    """band names of period `index` (those prefixed t{index}_) in a composite's band list"""
+    return [b for b in bands if b.startswith(f"t{index}_")]
+
+def static_bands(bands:list):
+    """band names without a period prefix (e.g. harmonics, JRC, topography) in a composite's band list"""
+    return [b for b in bands if PERIOD_PREFIX.match(b) is None]
+
+class Manifest:
+    """
+    Local JSON record of exported composites and the periods they cover, for incremental compositing
+
+    Each entry holds the dataset, settings fingerprint (see settings_fingerprint), aoi, the period start dates
+    covered, the asset they were exported to, the composite's band names, and the prefix its bands carry in
+    that asset (the dataset name in multi-dataset stacks). Entries added later win when several cover a period.
+    
+    Entries of submitted exports are 'pending' with their task id until refresh() finds the asset or the 
+    task COMPLETED ('completed'), or the task failed or was cancelled ('failed'). Only completed entries cover periods.
+
+    args:
+        path (str): manifest file path, loaded if it exists
+    """
+    def __init__(self,path:str):
+        self.path = path
+        self.entries = []
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)['composites']
+
+    def save(self):
+        """write the manifest to its path"""
+        with open(self.path,'w') as f:
+            json.dump({'composites':self.entries},f,indent=2)
+
+    def add(self,
+            dataset:str,
+            fingerprint:str,
+            aoi:str,
+            periods:list,
+            asset:str,
+            bands:list,
+            prefix:str='',
+            task_id:str=None):
+        """
+        record an exported composite, pending until refresh() confirms its export if a task_id is given.
+        `periods` should only hold complete periods (see complete_periods)
+        """
+        entry = {'dataset':dataset,
+                 'fingerprint':fingerprint,
+                 'aoi':aoi,
+                 'periods':list(periods),
+                 'asset':asset,
+                 'bands':list(bands),
+                 'prefix':prefix,
+                 'task_id':task_id,
+                 'status':'pending' if task_id is not None else 'completed'}
+        self.entries.append(entry)
+        return entry
+    
+    def refresh(self,asset_exists,task_state):
+        """
+        update the status of pending entries
+        args:
+            asset_exists (callable): asset path -> True if the asset exists, e.g. lambda a: rlcms.utils.check_exists(a) == 0
+            task_state (callable): task id -> ee batch task state, e.g. lambda t: ee.data.getTaskStatus(t)[0]['state']
+        returns:
+            list[dict]: entries still pending (exports not finished yet)
+        """
+        pending = []
+        for entry in self.entries:
+            if entry.get('status','completed') != 'pending':
+                continue
+            if asset_exists(entry['asset']):
+                entry['status'] = 'completed'
+                continue
+            state = task_state(entry['task_id'])
+            if state == 'COMPLETED':
+                entry['status'] = 'completed'
+            elif state in FAILED_STATES:
+                entry['status'] = 'failed'
+            else:
+                pending.append(entry)
+        return pending
+    
+    def _completed(self,fingerprint:str):
+        # entries written before statuses were recorded are completed exports
+        return [e for e in self.entries if e['fingerprint'] == fingerprint and e.get('status','completed') == 'completed']
+
+    def covered(self,fingerprint:str):
+        """
+        periods whose export with this fingerprint completed
+        returns:
+            dict: period start date -> manifest entry of the newest asset covering it
+        """
+        covered = {}
+        for entry in self._completed(fingerprint):
+            covered.update({p:entry for p in entry['periods']})
+        return covered
+
+    def missing(self,fingerprint:str,periods:list):
+        """periods not yet exported with this fingerprint, in the order given"""
+        covered = self.covered(fingerprint)
+        return [p for p in periods if p not in covered]
+
+    def latest(self,fingerprint:str):
+        """newest completed entry with this fingerprint, or None"""
+        entries = self._completed(fingerprint)
+        return entries[-1] if len(entries) > 0 else None
@@ -1,16 +1,87 @@
 import ee
 import os
+import numpy as np
 import pandas as pd
 from rlcms.utils import export_img_to_asset, export_image_to_drive
+from rlcms.local.forest import CompiledForest
 from ee.ee_exception import EEException
 import subprocess
 
+def select_uncorrelated(table:pd.DataFrame,threshold:float=0.9):
+    """
+    Greedily drop columns that are highly correlated with an earlier column
+    
+    Args:
+        table (pd.DataFrame): sampled band values, one column per band in order of preference
+        threshold (float): absolute Pearson correlation above which the later of two bands is dropped
+    
+    Returns:
+        list[str]: column names to keep
+    """
+    values = table.dropna().to_numpy(dtype=np.float64)
+    if values.shape[0] < 2:
+        raise ValueError("need at least 2 complete samples to compute band correlations")
+    with np.errstate(divide='ignore',invalid='ignore'):
+        corr = np.corrcoef(values,rowvar=False)
+    # constant bands have undefined correlation, never prune on them
+    redundant = np.triu(np.nan_to_num(np.abs(corr),nan=0.0) > threshold,k=1)
+    keep = np.ones(len(table.columns),dtype=bool)
+    for i in range(len(keep)):
+        if keep[i]:
+            keep[redundant[i]] = False
+    return list(table.columns[keep])
+
+def prune_correlated_bands(image,
+                           region=None,
+                           scale:int=30,
+                           threshold:float=0.9,
+                           num_pixels:int=2000,
+                           seed:int=51515):
+    """
+    Sample an image stack once and return its bands minus those redundant by correlation
+    
+    Args:
+        image (str|ee.Image): input image stack
+        region (ee.Geometry): Optional, area to sample. Defaults to the image footprint
+        scale (int): sampling scale
+        threshold (float): absolute Pearson correlation above which the later of two bands is dropped
+        num_pixels (int): approximate number of pixels to sample, the request holds num_pixels x bands values. Default 2000
+        seed (int): random seed
+    
+    Returns:
+        list[str]: band names to keep, in the image's band order
+    """
+    image = ee.Image(image)
+    if region is None:
+        region = image.geometry()
+    bands = image.bandNames()
+    samples = image.sample(region=region,scale=scale,numPixels=num_pixels,seed=seed,geometries=False)
+    # one list of sampled values per band rather than a feature per pixel, 
+    # with the band order in the same request
+    columns = samples.reduceColumns(ee.Reducer.toList().repeat(bands.size()),bands).get('list')
+    info = ee.Dictionary({'bands':bands,'columns':columns}).getInfo()
+    table = pd.DataFrame(dict(zip(info['bands'],info['columns'])),columns=info['bands'])
+    return select_uncorrelated(table,threshold)
+
+def prim_property(label):
+    """name of the binary training property of a class label, e.g. 6 -> 'PRIM_6' """
+    if float(label).is_integer():
+        label = int(label)
+    return f"PRIM_{label}".replace('.','_').replace('-','m')
+
 class Primitives:
     def __init__(self,
                  inputs=None,
                  training=None,
                  class_name=None,
-                 asset_id=None):
+                 asset_id=None,
+                 correlation_threshold=None,
+                 correlation_scale=30,
+                 correlation_num_pixels=2000,
+                 importance_mode='per_class',
+                 refine=False,
+                 screening_fraction=None,
+                 model_mode='binary'):
         """
         Construct a Primitives ensemble, provided an input ee.Image stack containing feature bands and a training point FeatureCollection
         
@@ -19,6 +90,18 @@ class Primitives:
             training (str|ee.FeatureCollection): training data
             class_name (str): class property containing class labels (i.e. 1, 2, 3), currently only 'LANDCOVER' is supported
             asset_id (str): Optional, GEE asset path to pre-existing Primitives ee.ImageCollection. Useful for exporting intermediary output approach
+            correlation_threshold (float): Optional, drop input bands whose absolute correlation with an earlier band exceeds this before training
+                (see prune_correlated_bands)
+            correlation_scale (int): scale at which the input stack is sampled for correlation pruning, default 30
+            correlation_num_pixels (int): approximate number of pixels sampled for correlation pruning, default 2000
+            importance_mode (str): 'per_class' (default) ranks features with an all-feature model of every primitive before retraining 
+                it on its top 20. 'shared' ranks features once with a single multiclass screening model and trains every 
+                primitive once on the shared top 20
+            refine (bool): in 'shared' mode, still rank features per primitive, but among the shared top 40 rather than all bands. Default False
+            screening_fraction (float): Optional, in 'shared' mode, train the screening model on this fraction of each class's points
+            model_mode (str): 'binary' (default) trains one probability model per class. 'multiclass' trains a single 
+                MULTIPROBABILITY model (on all bands, then its top 20) and splits its output into the same per-class 
+                Probability images, so a typology is classified once instead of once per class
         
         Returns: 
             Primitives object
@@ -42,24 +125,24 @@ class Primitives:
                 return p.set('LANDCOVER',int_val)
             return pts.map(to_int)
         
-        def format_pts(pts):
-            """Turn a FC of training points containing full LC typology into a list of primitive point FCs, 
-                    one point FC for each LC primitive"""
-            # create sets of binary training pts for each class represented in the full training pts collection
-            labels = ee.FeatureCollection(pts).aggregate_array('LANDCOVER').distinct().sort()
-            def binaryPts(l):
-                # create prim and non prim sets with filters, reset prim to 1, non-prim to 0
-                prim = pts.filter(ee.Filter.eq('LANDCOVER',l)).map(lambda f: f.set('PRIM',1))
-                non_prim = pts.filter(ee.Filter.neq('LANDCOVER',l)).map(lambda f: f.set('PRIM',0))
-                return ee.FeatureCollection(prim).merge(non_prim)
-            list_of_prim_pts = ee.List(labels).map(binaryPts)
-            return list_of_prim_pts
-
+        def binarize_pts(pts,labels,class_name):
+            """Add a binary PRIM_<label> property (1 in the class, 0 otherwise) for every class to each training point 
+                in a single pass, so all primitives share one binary training FC"""
+            def binaryProps(f):
+                label = ee.Number(f.get(class_name))
+                return f.set(ee.Dictionary.fromLists([prim_property(l) for l in labels],
+                                                     [label.eq(l) for l in labels]))
+            return ee.FeatureCollection(pts).map(binaryProps)
+        
         def gettop20(dict):
-            # if total input features count < 20, take them all, otherwise take top 20 most important
+            return gettop(dict,20)
+        
+        def gettop(dict,n):
+            # if total input features count < n, take them all, otherwise take top n most important
             dict = ee.Dictionary(dict)
             values = dict.values().sort()
-            cutoff = ee.Algorithms.If(values.size().gte(20),-20,values.size().multiply(-1))
+            # importance of the n-th most important feature, the smallest one kept
+            cutoff = values.get(values.size().min(n).multiply(-1))
             def kv_return(key,passedObj):
                 passedObj = ee.List(passedObj)
                 val = ee.Number(dict.get(key))
@@ -68,36 +151,64 @@ class Primitives:
             newl = dict.keys().iterate(kv_return,ee.List([]))
             return newl
         
-        def RFprim(training_pts,input_stack):
-            """Train and apply RF Probability classifier on a Primitive"""
-            inputs = ee.Image(input_stack)
-            samples = ee.FeatureCollection(training_pts)
-            
-            class_value = ee.Number(ee.Feature(samples.sort('PRIM',False).first()).get('LANDCOVER')) #get LC numeric value for the given primitive (i.e. 'PRIM':1, 'LANDCOVER':6) then map to its class label (i.e. 6: 'Water')
-            
+        def random_forest():
             # can experiment with classifier params for model performance
-            classifier = ee.Classifier.smileRandomForest(
+            return ee.Classifier.smileRandomForest(
             numberOfTrees=100, 
             minLeafPopulation=1, 
             bagFraction=0.7, 
-            seed=51515).setOutputMode('PROBABILITY')
+            seed=51515)
+        
+        def screen_features(training_pts,input_stack,labels,class_name):
+            """Rank input features once for all primitives with a multiclass model, 
+                optionally trained on a per-class stratified subsample of the points"""
+            samples = ee.FeatureCollection(training_pts)
+            if screening_fraction != None:
+                samples = ee.FeatureCollection([samples.filter(ee.Filter.eq(class_name,l))
+                                                       .randomColumn('screening',51515)
+                                                       .filter(ee.Filter.lt('screening',screening_fraction))
+                                                for l in labels]).flatten()
+            model = random_forest().train(features=samples,
+                                          classProperty=class_name,
+                                          inputProperties=ee.Image(input_stack).bandNames())
+            importance = ee.Dictionary(model.explain()).get('importance')
+            return ee.List(gettop20(importance) if not refine else gettop(importance,40))
+        
+        def RFprim(training_pts,input_stack,class_value,class_property,screened=None):
+            """Train and apply RF Probability classifier on a Primitive
             
-            # train model with all features
-            model = classifier.train(features=samples, 
-                                    classProperty='PRIM', 
-                                    inputProperties=inputs.bandNames() 
-                                    )
+            Args:
+                training_pts (ee.FeatureCollection): training pts with a binary 1/0 `class_property`
+                input_stack (ee.Image): of all covariates and predictor
+                class_value (int): class label of the primitive (i.e. 6 for 'Water')
+                class_property (str): binary property of the primitive, e.g. 'PRIM_6'
+                screened (ee.List): Optional, features ranked by a shared screening model. The primitive is trained once on 
+                    them, or ranks its own top 20 among them if refine
+            """
+            inputs = ee.Image(input_stack)
+            samples = ee.FeatureCollection(training_pts)
             
-            # store for model performance exploration
-            oob_all = ee.Dictionary(model.explain()).get('outOfBagErrorEstimate')
-            importance_all = ee.Dictionary(model.explain()).get('importance')
+            classifier = random_forest().setOutputMode('PROBABILITY')
             
-            # retrieve top 20 most important features
-            top20 = gettop20(importance_all)
+            if screened is None or refine:
+                # train model with all (or all screened) features
+                model = classifier.train(features=samples, 
+                                        classProperty=class_property, 
+                                        inputProperties=inputs.bandNames() if screened is None else screened
+                                        )
+                
+                # store for model performance exploration
+                oob_all = ee.Dictionary(model.explain()).get('outOfBagErrorEstimate')
+                importance_all = ee.Dictionary(model.explain()).get('importance')
+                
+                # retrieve top 20 most important features
+                top20 = gettop20(importance_all)
+            else:
+                top20 = screened
             
             # re-train model with top20 important features
             model = classifier.train(features=samples, 
-                                    classProperty='PRIM', 
+                                    classProperty=class_property, 
                                     inputProperties=top20
                                     )
             
@@ -115,6 +226,44 @@ class Primitives:
                            ))
             return output
 
+        def RFmulticlass(training_pts,input_stack,labels,class_name):
+            """Train one MULTIPROBABILITY RF on all classes and split its output into a Probability image per class
+            
+            Args:
+                training_pts (ee.FeatureCollection): training pts containing full LC typology
+                input_stack (ee.Image): of all covariates and predictor
+                labels (list): sorted class labels
+                class_name (str): property name in training points containing model classes
+            """
+            inputs = ee.Image(input_stack)
+            # class values become 0 to n-1, so each label's probability is at its index in the output array
+            samples = ee.FeatureCollection(training_pts).remap(labels,list(range(len(labels))),class_name)
+            classifier = random_forest().setOutputMode('MULTIPROBABILITY')
+            
+            # importance_mode does not apply, the multiclass model ranks features for all classes at once
+            # train model with all features, then re-train with top20 important features
+            model = classifier.train(features=samples,
+                                     classProperty=class_name,
+                                     inputProperties=inputs.bandNames())
+            top20 = gettop20(ee.Dictionary(model.explain()).get('importance'))
+            model = classifier.train(features=samples,
+                                     classProperty=class_name,
+                                     inputProperties=top20)
+            
+            oob_top20 = ee.Dictionary(model.explain()).get('outOfBagErrorEstimate')
+            importance_top20 = ee.Dictionary(model.explain()).get('importance')
+            schema = ee.List(ee.Classifier(model).schema())
+            probabilities = inputs.classify(model,'probabilities')
+            return [(probabilities.arrayGet([i])
+                     .rename('Probability')
+                     .set('Primitive',label,
+                          'importance',importance_top20, 
+                          'schema',schema, 
+                          'model',model,
+                          'oobError',oob_top20,
+                          ))
+                    for i,label in enumerate(labels)]
+
         def primitives_to_collection(input_stack,
                                      training_pts,
                                      class_name):
@@ -136,17 +285,31 @@ class Primitives:
             # list of distinct LANDCOVER values
             labels = training_pts.aggregate_array(class_name).distinct().sort().getInfo() # .sort() should fix Prims exporting out of order (i.e. 2,3,4,7,6)
 
-            # converting to index of the list of distinct LANDCOVER primtive FC's (prim_pts below)
-            indices = list(range(len(labels))) # handles dynamic land cover strata
+            if model_mode == 'multiclass':
+                return ee.ImageCollection.fromImages(RFmulticlass(training_pts,input_stack,labels,class_name))
+            
+            # format training pts to 1/0 prim format once, one PRIM_<label> property per class
+            prim_pts = binarize_pts(training_pts,labels,class_name)
+
+            # in shared mode features are ranked once for all primitives
+            screened = screen_features(training_pts,input_stack,labels,class_name) if importance_mode == 'shared' else None
 
             prim_list = []
-            for i in indices: # running one LC class at a time
-                prim_pts = ee.FeatureCollection(ee.List(format_pts(training_pts)).get(i)) # format training pts to 1/0 prim format
-                img = RFprim(prim_pts,input_stack) # run RF primitive model, get output image and metrics
+            for label in labels: # running one LC class at a time, handles dynamic land cover strata
+                img = RFprim(prim_pts,input_stack,label,prim_property(label),screened) # run RF primitive model, get output image and metrics
                 prim_list.append(img)
             
             return ee.ImageCollection.fromImages(prim_list)
         
+        if importance_mode not in ('per_class','shared'):
+            raise ValueError(f"importance_mode must be one of 'per_class' or 'shared', got: {importance_mode}")
+        if model_mode not in ('binary','multiclass'):
+            raise ValueError(f"model_mode must be one of 'binary' or 'multiclass', got: {model_mode}")
+        
+        self.model_mode = model_mode
+        self._metadata = None
+        self._primitive_values = None
+        
         # you can construct Primitives object from a pre-existing Primitives ImgColl
         if asset_id != None:
             try:
@@ -157,6 +320,12 @@ class Primitives:
             except: 
                 raise(EEException)
         else:
+            if correlation_threshold != None:
+                self.bands = prune_correlated_bands(inputs,
+                                                    scale=correlation_scale,
+                                                    threshold=correlation_threshold,
+                                                    num_pixels=correlation_num_pixels)
+                inputs = ee.Image(inputs).select(self.bands)
             primitives = primitives_to_collection(inputs,training,class_name)
             self.collection = primitives
             self.region = ee.Image(inputs).geometry().getInfo()
@@ -187,7 +356,7 @@ class Primitives:
         output = max_probability.add(1) # shift values from 0-n to 1-n, where n = bands
         
         if remap_to != None:
-            prims_count = self.collection.size().getInfo()
+            prims_count = len(self.primitive_values)
             remap_from = list(range(1,prims_count+1)) # values without a remap are 1 to n
             if len(remap_from) != len(remap_to):
                 raise ValueError("remap_to must be the same length as the number of primitives in the collection", 
@@ -197,29 +366,89 @@ class Primitives:
             pass
         return output.rename('LANDCOVER')
         
+    def compile_forests(self):
+        """
+        Fetch every primitive's trained trees in one request and compile them for local inference 
+        (see rlcms.local.forest.CompiledForest). Currently only works for Primitives objects in memory 
+        (not loaded from pre-existing ImgColl), since the models are not exported with the images
+        
+        Binary primitive trees print (yprob) as (P(0) P(1)), so their class 1 column is kept. In 'multiclass' 
+        model_mode every primitive shares one model, fetched once, and keeps the column of its label 
+        
+        Returns:
+            dict: Primitive class value -> CompiledForest whose single output is its probability, from a (band, y, x) stack
+        """
+        def model_info(img):
+            img = ee.Image(img)
+            explained = ee.Dictionary(ee.Classifier(img.get('model')).explain())
+            return ee.Dictionary({'Primitive':img.get('Primitive'),
+                                  'schema':img.get('schema'),
+                                  'trees':explained.get('trees')})
+        
+        imgColl = self.collection
+        if self.model_mode == 'multiclass':
+            # labels were remapped to 0 to n-1 in collection order, so a label's probability is the output at its index
+            info = ee.Dictionary({'model':model_info(imgColl.first()),
+                                  'primitives':imgColl.aggregate_array('Primitive')}).getInfo()
+            model = info['model']
+            return {p:CompiledForest.from_trees(model['trees'],model['schema'],output=i) 
+                    for i,p in enumerate(info['primitives'])}
+        
+        info = imgColl.toList(imgColl.size()).map(model_info).getInfo()
+        return {i['Primitive']:CompiledForest.from_trees(i['trees'],i['schema'],output=1) for i in info}
+    
+    @property
+    def primitive_values(self):
+        """
+        Primitive class value of every image in the collection, fetched in one request on first access and cached. 
+        The values are constants set on the images, so this does not train the models
+        
+        Returns:
+            list: one class value per primitive, in collection order
+        """
+        if self._primitive_values is None:
+            if self._metadata is not None:
+                self._primitive_values = [m['Primitive'] for m in self._metadata]
+            else:
+                self._primitive_values = self.collection.aggregate_array('Primitive').getInfo()
+        return self._primitive_values
+    
+    @property
+    def metadata(self):
+        """
+        Primitive, importance and oobError properties of every image in the collection, fetched in one request 
+        on first access and cached. Properties missing from the images (e.g. dictionaries dropped by asset export) are absent.
+        importance and oobError are computed by the trained models, so the request trains every primitive, 
+        use primitive_values when only the class values are needed
+        
+        Returns:
+            list[dict]: one dictionary per primitive, in collection order
+        """
+        if self._metadata is None:
+            imgColl = self.collection
+            self._metadata = (imgColl.toList(imgColl.size())
+                              .map(lambda img: ee.Image(img).toDictionary(['Primitive','importance','oobError']))
+                              .getInfo())
+        return self._metadata
+    
     def export_metrics(self,metrics_path):
             """
             Parse variable importance and OOB Error estimate from trained model, output to local files respectively
             Currently only works for Primitives objects in memory (not loaded from pre-existing ImgColl)
             """
-            # Var Importance to csv file
-            imgColl = self.collection
-            to_list = ee.List(imgColl.toList(imgColl.size()))
-            for i in list(range(imgColl.size().getInfo())):
-                img = ee.Image(to_list.get(i))
-                prim_value = str(img.get('Primitive').getInfo())
+            for prim in self.metadata:
+                prim_value = str(prim['Primitive'])
                 
                 # Variable Importance to .csv
-                dct = ee.Dictionary(img.get('importance')).getInfo()
+                dct = prim['importance']
                 _list = dct.values()
                 idx = dct.keys()
                 df = pd.DataFrame(_list, index = idx)
                 df.to_csv(os.path.join(metrics_path,f"varImportancePrimitive{prim_value}.csv"))
                 
                 # OOB error to .txt file
-                oob = img.get('oobError')
                 with open(os.path.join(metrics_path,f'oobErrorPrimitive{prim_value}.txt'),mode='w') as f:
-                    f.write(ee.String(ee.Number(oob).format()).getInfo())
+                    f.write(str(prim['oobError']))
                     f.close()
     
     def export_to_asset(self,
@@ -256,12 +485,14 @@ class Primitives:
                             f"Error message: {stdout.decode()}")
         
         # os.popen(f"earthengine create collection {collection_assetId}").read()
-        prims_count = self.collection.size().getInfo()
+        # descriptions come from the primitive values alone, fetching them does not train the models
+        primitive_values = self.primitive_values
+        prims_count = len(primitive_values)
         prims_list = ee.ImageCollection(self.collection).toList(prims_count)
         aoi = ee.Image(prims_list.get(0)).geometry()
         for i in list(range(prims_count)):
             prim = ee.Image(prims_list.get(i))
-            desc = f"Primitive{str(ee.Image(prim).get('Primitive').getInfo())}" # this would need to be defined in the Prims img for-loop
+            desc = f"Primitive{str(primitive_values[i])}"
             asset_id = f'{collection_assetId}/{desc}'
             export_img_to_asset(image=prim,
                                 description=desc,
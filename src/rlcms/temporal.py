@@ -0,0 +1,131 @@
+import numpy as np
+
+def _to_day(dates):
+    """str|list[str]|np.ndarray -> datetime64[D]"""
+    return np.asarray([str(d).split(' ')[0].split('T')[0] for d in np.atleast_1d(dates)],dtype='datetime64[D]')
+
+def season_months(season:list):
+    """validate a season spec (consecutive months, e.g. ['11','12','01']) and return its months as ints"""
+    if season is None or len(season) == 0:
+        raise ValueError("season must be a non-empty list of consecutive months, e.g. ['01','02','03']")
+    months = [int(m) for m in season]
+    for m in months:
+        if m < 1 or m > 12:
+            raise ValueError(f"season months must be between 1 and 12, got: {season}")
+    for a,b in zip(months[:-1],months[1:]):
+        if b != a % 12 + 1:
+            raise ValueError(f"season months must be consecutive, got: {season}")
+    if len(months) > 12:
+        raise ValueError(f"season can not be longer than 12 months, got: {season}")
+    return months
+
+def parse_seasons(season):
+    """
+    Read a multi-season spec, either a {name: months} dict (e.g. {'wet':['11','12','01'],'dry':['06','07','08']})
+    or a list of month lists (named 's0', 's1', ...)
+    returns:
+        dict: season name -> months as ints, or None if `season` is a single season (a flat list of months)
+    """
+    if season is None or (isinstance(season,(list,tuple)) and not any(isinstance(m,(list,tuple)) for m in season)):
+        return None
+    if isinstance(season,dict):
+        items = list(season.items())
+    elif all(isinstance(m,(list,tuple)) for m in season):
+        items = [(f"s{i}",m) for i,m in enumerate(season)]
+    else:
+        raise ValueError(f"season must be a list of months, a list of month lists or a {{name: months}} dict, got: {season}")
+    if len(items) == 0:
+        raise ValueError("season must contain at least one season")
+    return {str(name):season_months(months) for name,months in items}
+
+def agg_timing(start_date:str,
+               end_date:str,
+               composite_mode:str='annual',
+               season:list=None,
+               scene_dates=None):
+    """
+    Compute the `period`, `period_unit` and `dates` args of hf.Dataset.aggregate_time() client-side
+
+    Annual periods start on Jan 1st of every year between start_date and end_date, seasonal periods on
+    the first day of the season's first month of those years, if the season overlaps the date range.
+    end_date is exclusive like ee.ImageCollection.filterDate(), so a period starting on end_date is not included.
+    When scene dates are already available locally, periods without any scene are dropped.
+
+    args:
+        start_date (str): start date (yyyy-mm-dd)
+        end_date (str): end date (yyyy-mm-dd), exclusive
+        composite_mode (str): one of 'annual' or 'seasonal', Default = 'annual'
+        season (list[str|int]): consecutive list of months (e.g. ['01','02','03']) comprising the season.
+            A required arg if composite_mode == 'seasonal'
+        scene_dates (list[str]|np.ndarray): Optional, acquisition dates of the scenes
+    returns:
+        tuple(period(int),period_unit(str),dates(list[str]))
+    """
+    start,end = _to_day([start_date,end_date])
+    if end < start:
+        raise ValueError(f"end_date {end_date} is before start_date {start_date}")
+    first_year = int(str(start.astype('datetime64[Y]')))
+    last_year = int(str(end.astype('datetime64[Y]')))
+    years = np.arange(first_year,last_year+1)
+
+    if composite_mode == 'seasonal':
+        if season is None:
+            raise ValueError("season arg required if composite_mode == 'seasonal'")
+        months = season_months(season)
+        period = len(months)
+        period_unit = 'month'
+        starts = np.asarray([f"{y}-{months[0]:02d}" for y in years],dtype='datetime64[M]')
+    elif composite_mode == 'annual':
+        period = 1
+        period_unit = 'year'
+        starts = np.asarray([f"{y}-01" for y in years],dtype='datetime64[M]')
+    else:
+        raise ValueError(f"{composite_mode} not a valid 'composite_mode'. Choose one of 'annual' or 'seasonal'")
+
+    ends = period_ends(starts,period,period_unit)
+    starts = starts.astype('datetime64[D]')
+    # end_date is exclusive, as in filterDate()
+    overlaps = (starts < end) & (ends > start)
+    starts,ends = starts[overlaps],ends[overlaps]
+
+    if scene_dates is not None:
+        bins = bin_dates(scene_dates,starts,ends)
+        starts = starts[np.unique(bins[bins >= 0])]
+
+    return period,period_unit,[str(d) for d in starts]
+
+def period_ends(starts,period:int,period_unit:str):
+    """exclusive end dates (datetime64[D]) of periods beginning on `starts`"""
+    starts = np.asarray(starts,dtype='datetime64[M]')
+    if period_unit == 'year':
+        return (starts + 12*period).astype('datetime64[D]')
+    elif period_unit == 'month':
+        return (starts + period).astype('datetime64[D]')
+    raise ValueError(f"period_unit must be one of 'year' or 'month', got: {period_unit}")
+
+def bin_dates(scene_dates,starts,ends=None,period:int=None,period_unit:str=None):
+    """
+    Assign each scene to the period containing it with a vectorized sorted search
+
+    args:
+        scene_dates (list[str]|np.ndarray): acquisition dates of the scenes, in any order
+        starts (list[str]|np.ndarray): period start dates, sorted and non-overlapping
+        ends (list[str]|np.ndarray): Optional, exclusive period end dates. Computed from period
+            and period_unit if not given
+        period (int): period length, used if ends is None
+        period_unit (str): one of 'year' or 'month', used if ends is None
+    returns:
+        np.ndarray: int index into starts for every scene, -1 for scenes outside all periods
+    """
+    scenes = _to_day(scene_dates)
+    starts = _to_day(starts)
+    if ends is None:
+        if period is None or period_unit is None:
+            raise ValueError("either ends or period and period_unit are required")
+        ends = period_ends(starts,period,period_unit)
+    ends = _to_day(ends)
+
+    bins = np.searchsorted(starts,scenes,side='right') - 1
+    inside = bins >= 0
+    inside[inside] = scenes[inside] < ends[bins[inside]]
+    return np.where(inside,bins,-1)
@@ -0,0 +1,54 @@
+import warnings
+import numpy as np
+from rlcms.local import composites
+
+rng = np.random.default_rng(51515)
+dates = ['2020-02-01','2020-06-15','2020-11-30','2021-01-10','2021-03-05','2021-07-21','2021-12-01']
+cube = rng.uniform(0,1,size=(7,2,19,11)).astype(np.float32)
+cube[rng.uniform(size=cube.shape) < 0.3] = np.nan
+cube[:3,:,0,0] = np.nan # a pixel with no valid values in 2020
+
+def test_nan_quantiles_match_numpy():
+    values = cube.reshape(7,-1)
+    result = composites.nan_quantiles(values,[0.2,0.5,0.8])
+    expected = np.nanpercentile(values,[20,50,80],axis=0)
+    np.testing.assert_allclose(result,expected,rtol=1e-6,equal_nan=True)
+
+def test_annual_composites():
+    out,names = composites.composite_cube(cube,dates,['red','nir'],'2020-01-01','2021-12-31',
+                                          reducers=['median','mean','p80'],chunk_size=4,max_workers=3)
+    assert names[:6] == ['t0_red_median','t0_red_mean','t0_red_p80','t0_nir_median','t0_nir_mean','t0_nir_p80']
+    assert out.shape == (12,19,11)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore',RuntimeWarning)
+        np.testing.assert_allclose(out[names.index('t1_nir_median')],np.nanmedian(cube[3:,1],axis=0),rtol=1e-6)
+        np.testing.assert_allclose(out[names.index('t0_red_mean')],np.nanmean(cube[:3,0],axis=0),rtol=1e-6,equal_nan=True)
+    assert np.isnan(out[names.index('t0_red_p80'),0,0])
+
+def test_seasonal_composite_single_period():
+    out,names = composites.composite_cube(cube,dates,['red','nir'],'2020-01-01','2021-10-31',
+                                          composite_mode='seasonal',season=['11','12','01'])
+    # the 2021 season starts after end_date
+    assert names == ['red_mean','nir_mean']
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore',RuntimeWarning)
+        np.testing.assert_allclose(out[1],np.nanmean(cube[2:4,1],axis=0),rtol=1e-6,equal_nan=True)
+
+def test_histogram_sketch():
+    sketch = composites.HistogramSketch(cube.shape[1:],(0,1),bins=200)
+    for scene in cube:
+        sketch.update(scene)
+    approx = sketch.percentiles([0.2,0.5,0.8])
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore',RuntimeWarning)
+        exact = np.nanpercentile(cube,[20,50,80],axis=0)
+    # within one bin width of the exact percentile
+    np.testing.assert_allclose(approx,exact,atol=1/200+1e-6,equal_nan=True)
+
+def test_approximate_composites():
+    reducers = ['p20','median','mean','max']
+    exact,names = composites.composite_cube(cube,dates,['red','nir'],'2020-01-01','2021-12-31',reducers=reducers)
+    approx,approx_names = composites.composite_cube(cube,dates,['red','nir'],'2020-01-01','2021-12-31',reducers=reducers,
+                                                    approximate=True,value_range=(0,1),bins=500,chunk_size=5)
+    assert approx_names == names
+    np.testing.assert_allclose(approx,exact,atol=1/500+1e-6,equal_nan=True)
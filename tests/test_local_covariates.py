@@ -0,0 +1,80 @@
+import numpy as np
+from rlcms.local import covariates, pipeline
+from rlcms.formulas import compile_formulas, INDEX_FORMULAS
+
+rng = np.random.default_rng(51515)
+stack = rng.uniform(0.01,0.5,size=(6,37,23)).astype(np.float32)
+blue,green,red,nir,swir1,swir2 = stack.astype(np.float64)
+
+def test_compute_indices_values():
+    out = covariates.compute_indices(stack,chunk_size=8)
+    names = list(covariates.INDICES.keys())
+    assert out.shape == (len(names),37,23)
+    assert out.dtype == np.float32
+
+    ibi_a = 2*swir1/(swir1+nir)
+    ibi_b = nir/(nir+red) + green/(green+swir1)
+    expected = {'ND_nir_red':(nir-red)/(nir+red),
+                'ND_swir1_swir2':(swir1-swir2)/(swir1+swir2),
+                'R_swir1_nir':swir1/nir,
+                'EVI':2.5*((nir-red)/(nir+6*red-7.5*blue+1)),
+                'SAVI':(nir-red)*1.5/(nir+red+0.5),
+                'IBI':(ibi_a-ibi_b)/(ibi_a+ibi_b)}
+    for name,value in expected.items():
+        np.testing.assert_allclose(out[names.index(name)],value,rtol=1e-4,atol=1e-6)
+
+def test_compute_indices_subset_into_preallocated():
+    out = np.zeros((2,37,23),dtype=np.float32)
+    result = covariates.compute_indices(stack,['SAVI','ND_green_nir'],out=out)
+    assert result is out
+    np.testing.assert_allclose(out[1],(green-nir)/(green+nir),rtol=1e-5,atol=1e-6)
+
+def test_negative_inputs_masked():
+    neg = stack.copy()
+    neg[2,0,0] = -0.1
+    out = covariates.compute_indices(neg,['ND_nir_red','R_red_swir1'])
+    assert np.isnan(out[0,0,0])
+    assert not np.isnan(out[1,0,0])
+
+def test_formulas_match_catalogue():
+    compiled = compile_formulas(INDEX_FORMULAS)
+    out = compiled.evaluate(stack,covariates.BANDS,chunk_size=8)
+    expected = covariates.compute_indices(stack,compiled.names)
+    np.testing.assert_allclose(out,expected,rtol=1e-4,atol=1e-6)
+
+def test_formulas_share_subexpressions():
+    compiled = compile_formulas({'ND_nir_red':'(nir - red) / (nir + red)',
+                                 'SAVI':'(nir - red) * 1.5 / (red + nir + 0.5)'})
+    assert len(compiled.temporaries) == 2
+    assert compile_formulas({'ND_nir_red':'(nir - red) / (nir + red)',
+                             'SAVI':'(nir - red) * 1.5 / (red + nir + 0.5)'}) is compiled
+    out = compiled.evaluate(stack,covariates.BANDS)
+    np.testing.assert_allclose(out[1],(nir-red)*1.5/(nir+red+0.5),rtol=1e-5,atol=1e-6)
+
+def test_tasseled_cap():
+    out = covariates.tasseled_cap(stack[[5,0,1,2,3,4]],bands=['swir2']+covariates.BANDS[:5],chunk_size=10)
+    names = covariates.tasseled_cap_bands()
+    assert out.shape == (12,37,23)
+    coefs = np.array(covariates.TASSELED_CAP_COEFFICIENTS['Landsat5'])
+    components = np.einsum('cb,byx->cyx',coefs,stack.astype(np.float64))
+    np.testing.assert_allclose(out[:6],components,rtol=1e-4,atol=1e-5)
+    np.testing.assert_allclose(out[names.index('tcAngleGW')],np.arctan2(components[1],components[2])/np.pi,rtol=1e-4,atol=1e-5)
+    np.testing.assert_allclose(out[names.index('tcDistBW')],np.hypot(components[0],components[2]),rtol=1e-4,atol=1e-5)
+
+    assert covariates.tasseled_cap(stack,sensor='Sentinel2').shape == (9,37,23)
+
+def test_streaming_pipeline(tmp_path):
+    bands = covariates.BANDS + ['elevation']
+    elevation = np.add.outer(np.arange(37),np.arange(23)*2.).astype(np.float32)*10
+    np.save(tmp_path/'stack.npy',np.concatenate([stack,elevation[None]]))
+
+    names = pipeline.covariates_from_options(str(tmp_path/'stack.npy'),str(tmp_path/'covariates.npy'),bands,
+                                             block_size=10,max_workers=2,pixel_size=30,
+                                             indices=['ND_nir_red','SAVI'],addTasselCap=True,addTopography=True)
+    out = np.load(tmp_path/'covariates.npy')
+    assert names[:7] == bands
+    assert out.shape == (len(names),37,23)
+    np.testing.assert_allclose(out[names.index('SAVI')],covariates.compute_indices(stack,['SAVI'])[0])
+    np.testing.assert_allclose(out[names.index('tcDistGW')],covariates.tasseled_cap(stack)[-2])
+    # block edges read a halo, so topography matches a whole-raster computation
+    np.testing.assert_allclose(out[names.index('slope')],covariates.topography(elevation,30)[0])
@@ -0,0 +1,73 @@
+import numpy as np
+from rlcms.local import forest
+
+TREE_A = """n=50
+node), split, n, deviance, yval
+      * denotes terminal node
+
+1) root 50 12.5 0
+  2) nir<=0.3 30 4.1 0
+    4) ND_nir_red<=-0.1 10 0 1 *
+    5) ND_nir_red>-0.1 20 2 0 *
+  3) nir>0.3 20 1 1 *
+"""
+TREE_B = """1) root 50 12.5 0
+  2) swir1>0.2 25 1 0 *
+  3) swir1<=0.2 25 1 1 *
+"""
+
+def test_parse_tree():
+    tree = forest.parse_tree(TREE_A,['swir1','nir','ND_nir_red'])
+    assert tree['feature'].tolist() == [1,2,-1,-1,-1]
+    np.testing.assert_allclose(tree['threshold'][:2],[0.3,-0.1])
+    assert tree['left'][:2].tolist() == [1,3]
+    assert tree['value'][:,0].tolist() == [0,0,1,1,0]
+    # the `<=` branch is the left child even when listed second
+    assert forest.parse_tree(TREE_B,['swir1'])['left'][0] == 2
+
+def test_compiled_forest_predict():
+    features = ['swir1','nir','ND_nir_red']
+    compiled = forest.CompiledForest.from_trees([TREE_A,TREE_B],features)
+    rng = np.random.default_rng(7)
+    stack = rng.uniform(-0.5,0.5,size=(3,11,5)).astype(np.float32)
+    stack[0,0,0] = np.nan
+    out = compiled.predict_stack(stack,chunk_size=4)
+    swir1,nir,nd = stack.astype(np.float64)
+    a = np.where(nir > 0.3,1,np.where(nd <= -0.1,1,0))
+    b = np.where(swir1 <= 0.2,1,0)
+    expected = (a+b)/2
+    assert np.isnan(out[0,0,0])
+    np.testing.assert_allclose(out[0].ravel()[1:],expected.ravel()[1:])
+
+    reordered = compiled.predict_stack(stack[[2,0,1]],bands=['ND_nir_red','swir1','nir'])
+    np.testing.assert_allclose(reordered,out)
+
+def test_probability_leaves():
+    tree = """1) root 10 5 0 (0.6 0.4)
+  2) red<=0.1 6 1 0 (0.9 0.1) *
+  3) red>0.1 4 1 1 (0.25 0.75) *"""
+    compiled = forest.CompiledForest.from_trees([tree],['red'])
+    np.testing.assert_allclose(compiled.predict(np.array([[0.0,0.5,0.2]]),batch_size=2),[[0.9,0.25,0.25],[0.1,0.75,0.75]])
+
+# layout of ee.Classifier.smileRandomForest().setOutputMode('PROBABILITY').explain()['trees'] entries
+EXPLAIN_TREE = """n= 70
+
+node), split, n, loss, yval, (yprob)
+      * denotes terminal node
+
+ 1) root 70 26.0000 0 (0.62857 0.37143)
+   2) ND_nir_red<=0.30500000715255737 44 1.0000 0 (0.97778 0.02222)
+     4) nir<=0.25 30 0.0000 0 (1.00000 0.00000) *
+     5) nir>0.25 14 1.0000 0 (0.93333 0.06667) *
+   3) ND_nir_red>0.30500000715255737 26 0.0000 1 (0.03571 0.96429) *
+"""
+
+def test_explain_tree_class_probability():
+    features = ['nir','ND_nir_red']
+    values = np.array([[0.1,0.4,0.1],[0.2,0.2,0.5]])
+    both = forest.CompiledForest.from_trees([EXPLAIN_TREE],features).predict(values)
+    np.testing.assert_allclose(both,[[1.0,0.93333,0.03571],[0.0,0.06667,0.96429]],rtol=1e-5)
+    # a binary primitive's probability is the class 1 column
+    primitive = forest.CompiledForest.from_trees([EXPLAIN_TREE],features,output=1)
+    assert primitive.n_outputs == 1
+    np.testing.assert_allclose(primitive.predict(values),both[[1]])
@@ -0,0 +1,66 @@
+import numpy as np
+from rlcms.local import harmonics
+
+rng = np.random.default_rng(2024)
+dates = np.datetime64('2019-01-03') + np.sort(rng.choice(365*3,size=40,replace=False))
+X = harmonics.design_matrix(dates)
+truth = rng.normal(size=(4,9,7))
+series = np.einsum('tk,kyx->tyx',X,truth) + rng.normal(scale=1e-3,size=(40,9,7))
+
+def test_time_constant():
+    np.testing.assert_allclose(harmonics.time_constant(['1970-01-01','2020-07-02','2021-12-31 10:00:00']),
+                               [0,50+183/366,51+364/365])
+
+def test_day_of_year_mask():
+    mask = harmonics.day_of_year_mask(['2021-01-05','2021-06-01','2021-12-20'],335,31)
+    assert mask.tolist() == [True,False,True]
+
+def test_coefficients_with_masked_pixels():
+    masked = series.copy()
+    masked[rng.random(masked.shape) < 0.3] = np.nan
+    masked[:-3,0,0] = np.nan # too few scenes to fit
+    coefficients = harmonics.harmonic_coefficients(masked,dates,chunk_size=4,max_workers=2)
+    assert np.isnan(coefficients[:,0,0]).all()
+    np.testing.assert_allclose(coefficients[:,1:],truth[:,1:],atol=0.1)
+
+    valid = ~np.isnan(masked[:,2,3])
+    expected = np.linalg.lstsq(X[valid],masked[valid,2,3],rcond=None)[0]
+    np.testing.assert_allclose(coefficients[:,2,3],expected,rtol=1e-4,atol=1e-5)
+
+def test_harmonics_from_options():
+    cube = np.stack([series,series*2],axis=1).astype(np.float32)
+    options = {'swir1':{'start':1,'end':365},'nir':{'start':100,'end':250}}
+    out,names = harmonics.harmonics_from_options(cube,dates.astype(str),['nir','swir1'],options)
+    assert names == ['nir_phase','nir_amplitude','swir1_phase','swir1_amplitude']
+
+    swir1 = harmonics.harmonic_coefficients(cube[:,1],dates)
+    np.testing.assert_allclose(out[2],np.arctan2(swir1[2],swir1[3]),rtol=1e-5,atol=1e-5)
+    np.testing.assert_allclose(out[3],np.hypot(swir1[2],swir1[3]),rtol=1e-5,atol=1e-5)
+
+    window = harmonics.day_of_year_mask(dates,100,250)
+    nir = harmonics.harmonic_coefficients(cube[window,0],dates[window])
+    np.testing.assert_allclose(out[1],np.hypot(nir[2],nir[3]),rtol=1e-5,atol=1e-5)
+
+def test_accumulator_matches_batch_fit(tmp_path):
+    masked = series.copy()
+    masked[rng.random(masked.shape) < 0.2] = np.nan
+    accumulator = harmonics.HarmonicAccumulator((9,7),epoch_year=2019)
+    accumulator.update(masked[:25],dates[:25],chunk_size=4)
+    accumulator.save(str(tmp_path/'stats.npz'))
+
+    # fold in the remaining scenes after a save/load round trip
+    accumulator = harmonics.HarmonicAccumulator.load(str(tmp_path/'stats.npz'))
+    accumulator.update(masked[25:],dates[25:])
+    bands,names = accumulator.harmonics('nir')
+    assert names == ['nir_phase','nir_amplitude']
+
+    expected = harmonics.phase_amplitude(harmonics.harmonic_coefficients(masked,dates))
+    np.testing.assert_allclose(bands,expected,rtol=1e-3,atol=1e-3)
+
+def test_accumulator_higher_order():
+    X = harmonics.design_matrix(dates,order=2,epoch_year=2019)
+    truth = rng.normal(size=(6,3,4))
+    values = np.einsum('tk,kyx->tyx',X,truth)
+    accumulator = harmonics.HarmonicAccumulator((3,4),order=2,epoch_year=2019).update(values,dates)
+    np.testing.assert_allclose(accumulator.coefficients(),truth,rtol=1e-3,atol=1e-3)
+    assert accumulator.harmonics('red')[1] == ['red_phase','red_amplitude','red_phase2','red_amplitude2']
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("sklearn")
+from rlcms.local import primitives
+
+rng = np.random.default_rng(3)
+n = 300
+labels = rng.choice([1,2,5],size=n)
+table = pd.DataFrame({'LANDCOVER':labels,
+                      'random':rng.random(n),
+                      'system:index':[str(i) for i in range(n)]})
+for i in range(25):
+    table[f'b{i}'] = rng.normal(size=n) + (labels == [1,2,5][i % 3])*(i < 6)
+
+def test_train_primitives(tmp_path):
+    assert primitives.sample_features(table) == [f'b{i}' for i in range(25)]
+    prims = primitives.train_primitives(table,max_workers=2,n_estimators=20)
+    assert [p['Primitive'] for p in prims] == [1,2,5]
+    for p in prims:
+        assert len(p['features']) == 20
+        assert set(p['importance']) == set(p['features'])
+        assert 0 <= p['oobError'] <= 1
+
+    primitives.export_metrics(prims,str(tmp_path))
+    importance = pd.read_csv(tmp_path/'varImportancePrimitive5.csv',index_col=0)
+    assert list(importance.index) == list(prims[2]['importance'])
+    assert float((tmp_path/'oobErrorPrimitive1.txt').read_text()) == prims[0]['oobError']
+
+def test_compiled_primitives_match_sklearn():
+    prims = primitives.train_primitives(table,max_workers=1,n_estimators=15)
+    compiled = primitives.compile_primitives(prims)
+    p = prims[1]
+    X = table[p['features']].to_numpy(dtype=np.float32)
+    expected = p['model'].predict_proba(X)[:,1]
+    np.testing.assert_allclose(compiled[2].predict(X.T)[0],expected,atol=1e-5)
+
+def test_shared_importance_mode():
+    shared = primitives.train_primitives(table,max_workers=1,n_estimators=15,importance_mode='shared',screening_fraction=0.5)
+    assert [p['fits'] for p in shared] == [1,1,1]
+    assert all(p['features'] == shared[0]['features'] for p in shared)
+
+    refined = primitives.train_primitives(table,max_workers=1,n_estimators=15,top=5,importance_mode='shared',refine=True)
+    assert [p['fits'] for p in refined] == [2,2,2]
+    assert all(len(p['features']) == 5 for p in refined)
+
+def test_multiclass_mode():
+    prims = primitives.train_primitives(table,n_estimators=15,model_mode='multiclass')
+    assert [p['Primitive'] for p in prims] == [1,2,5]
+    assert sum(p['fits'] for p in prims) == 2
+    X = table[prims[0]['features']].to_numpy(dtype=np.float32)
+    probabilities = np.stack([primitives.primitive_probability(p,X) for p in prims])
+    np.testing.assert_allclose(probabilities.sum(axis=0),1,atol=1e-6)
+    compiled = primitives.compile_primitives(prims)
+    np.testing.assert_allclose(compiled[5].predict(X.T)[0],probabilities[2],atol=1e-5)
@@ -0,0 +1,73 @@
+from rlcms import manifest
+
+settings = {'indices':['EVI'],'composite_mode':'annual','reducer':'median'}
+
+def test_settings_fingerprint():
+    fp = manifest.settings_fingerprint('Landsat8','aoi/path','2019-01-01',settings)
+    assert fp == manifest.settings_fingerprint('Landsat8','aoi/path','2019-01-01',
+                                               dict(reversed(list(settings.items())),periods=['2019-01-01']))
+    assert fp != manifest.settings_fingerprint('Landsat8','aoi/path','2019-01-01',dict(settings,reducer='mean'))
+    assert fp != manifest.settings_fingerprint('Sentinel2','aoi/path','2019-01-01',settings)
+
+def test_band_groups():
+    bands = ['t0_blue','t0_nir','t1_blue','t10_blue','swir1_phase','elevation']
+    assert manifest.period_bands(bands,1) == ['t1_blue']
+    assert manifest.static_bands(bands) == ['swir1_phase','elevation']
+
+def test_manifest_roundtrip(tmp_path):
+    path = str(tmp_path/'manifest.json')
+    m = manifest.Manifest(path)
+    assert m.missing('abc',['2019-01-01']) == ['2019-01-01']
+    m.add('Landsat8','abc','aoi/path',['2019-01-01','2020-01-01'],'out/v1',['t0_blue','t1_blue'])
+    m.add('Landsat8','abc','aoi/path',['2019-01-01','2020-01-01','2021-01-01'],'out/v2',['t0_blue','t1_blue','t2_blue'])
+    m.add('Landsat8','other','aoi/path',['2022-01-01'],'out/x',['blue'])
+    m.save()
+
+    loaded = manifest.Manifest(path)
+    assert {p:e['asset'] for p,e in loaded.covered('abc').items()} == {'2019-01-01':'out/v2',
+                                                                      '2020-01-01':'out/v2',
+                                                                      '2021-01-01':'out/v2'}
+    assert loaded.missing('abc',['2020-01-01','2021-01-01','2022-01-01']) == ['2022-01-01']
+    assert loaded.latest('abc')['asset'] == 'out/v2'
+    assert loaded.latest('none') is None
+
+def test_failed_export_not_covered(tmp_path):
+    path = str(tmp_path/'manifest.json')
+    m = manifest.Manifest(path)
+    m.add('Landsat8','abc','aoi/path',['2019-01-01'],'out/v1',['t0_blue'])
+    m.add('Landsat8','abc','aoi/path',['2019-01-01','2020-01-01'],'out/v2',['t0_blue','t1_blue'],task_id='TASK2')
+    m.add('Landsat8','abc','aoi/path',['2019-01-01','2020-01-01','2021-01-01'],'out/v3',['t0_blue','t1_blue','t2_blue'],task_id='TASK3')
+    m.save()
+
+    # submitted exports do not cover their periods until confirmed
+    loaded = manifest.Manifest(path)
+    assert loaded.missing('abc',['2019-01-01','2020-01-01']) == ['2020-01-01']
+    assert loaded.latest('abc')['asset'] == 'out/v1'
+
+    states = {'TASK2':'FAILED','TASK3':'RUNNING'}
+    pending = loaded.refresh(asset_exists=lambda a: False,task_state=states.get)
+    assert [e['asset'] for e in pending] == ['out/v3']
+    assert [e['status'] for e in loaded.entries] == ['completed','failed','pending']
+    assert {p:e['asset'] for p,e in loaded.covered('abc').items()} == {'2019-01-01':'out/v1'}
+
+    # the failed export stays failed, the running one completes once its asset exists
+    assert loaded.refresh(asset_exists=lambda a: a == 'out/v3',task_state=states.get) == []
+    assert loaded.missing('abc',['2019-01-01','2020-01-01','2021-01-01']) == []
+    assert loaded.covered('abc')['2020-01-01']['asset'] == 'out/v3'
+
+def test_partial_period_recomputed(tmp_path):
+    path = str(tmp_path/'manifest.json')
+    # first run ends mid 2020, so 2020 is only half covered and not recorded
+    periods = ['2019-01-01','2020-01-01']
+    recorded = manifest.complete_periods(periods,'2020-07-01',1,'year')
+    assert recorded == ['2019-01-01']
+    m = manifest.Manifest(path)
+    m.add('Landsat8','abc','aoi/path',recorded,'out/v1',['t0_blue','t1_blue'])
+    m.save()
+
+    # extending the range recomputes the partial period
+    periods = ['2019-01-01','2020-01-01','2021-01-01']
+    assert manifest.Manifest(path).missing('abc',periods) == ['2020-01-01','2021-01-01']
+    assert manifest.complete_periods(periods,'2022-01-01',1,'year') == periods
+    assert manifest.complete_periods(['2020-11-01'],'2021-01-31',3,'month') == []
+    assert manifest.complete_periods(['2020-11-01'],'2021-02-01',3,'month') == ['2020-11-01']
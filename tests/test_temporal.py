@@ -0,0 +1,41 @@
+import pytest
+from rlcms import temporal
+
+def test_annual_timing():
+    assert temporal.agg_timing('2019-03-01','2021-06-30') == (1,'year',['2019-01-01','2020-01-01','2021-01-01'])
+
+def test_seasonal_timing():
+    period,period_unit,dates = temporal.agg_timing('2020-01-01','2021-12-31','seasonal',season=['11','12','01'])
+    assert (period,period_unit,dates) == (3,'month',['2020-11-01','2021-11-01'])
+    # season entirely after end_date is dropped
+    assert temporal.agg_timing('2020-01-01','2021-08-31','seasonal',season=[10,11])[2] == ['2020-10-01']
+
+def test_timing_drops_empty_periods():
+    scenes = ['2021-05-03 10:00:00','2019-07-01','2021-01-01']
+    assert temporal.agg_timing('2019-01-01','2021-12-31',scene_dates=scenes)[2] == ['2019-01-01','2021-01-01']
+
+def test_bin_dates():
+    bins = temporal.bin_dates(['2020-12-31','2021-02-28','2021-03-01','2019-01-01'],
+                              ['2020-12-01','2021-12-01'],period=3,period_unit='month')
+    assert bins.tolist() == [0,0,-1,-1]
+
+def test_invalid_season():
+    for season in [['01','03'],[],[13]]:
+        try:
+            temporal.agg_timing('2020-01-01','2021-01-01','seasonal',season=season)
+        except ValueError:
+            continue
+        raise AssertionError(f"{season} should be invalid")
+
+def test_parse_seasons():
+    assert temporal.parse_seasons(['11','12','01']) is None
+    assert temporal.parse_seasons({'wet':['11','12','01'],'dry':[6,7,8]}) == {'wet':[11,12,1],'dry':[6,7,8]}
+    assert temporal.parse_seasons([['01','02'],['07','08']]) == {'s0':[1,2],'s1':[7,8]}
+    with pytest.raises(ValueError):
+        temporal.parse_seasons([['01','03']])
+
+def test_timing_end_date_exclusive():
+    # a range ending on a period start does not get an (empty) period for it, as filterDate() excludes end_date
+    assert temporal.agg_timing('2021-01-01','2022-01-01') == (1,'year',['2021-01-01'])
+    assert temporal.agg_timing('2020-01-01','2021-11-01','seasonal',season=['11','12','01'])[2] == ['2020-11-01']
+    assert temporal.agg_timing('2020-01-01','2021-11-02','seasonal',season=['11','12','01'])[2] == ['2020-11-01','2021-11-01']